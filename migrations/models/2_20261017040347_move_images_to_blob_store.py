@@ -0,0 +1,198 @@
+import base64
+import hashlib
+import os
+from collections import Counter
+from pathlib import Path
+
+from tortoise import BaseDBAsyncClient
+
+RUN_IN_TRANSACTION = True
+
+# AICODE-NOTE: Миграция переносит base64-фото из goals/checkins в BlobStore
+# (файлы на диске) и оставляет в строках только SHA-256.
+# Сырые запросы учитывают диалект: SQLite (?) и PostgreSQL ($1).
+# src.config не импортируется (он требует BOT_TOKEN/OPENAI_KEY), путь к
+# хранилищу берётся из окружения; раскладка файлов — как в BlobStore.path_for.
+
+
+def _blob_root() -> Path:
+    return Path(os.environ.get("BLOB_STORE_PATH", "data/blobs"))
+
+
+def _blob_path(root: Path, sha256: str) -> Path:
+    return root / sha256[:2] / sha256[2:4] / sha256
+
+
+def _write_blob(path: Path, data: bytes) -> bool:
+    """Записывает файл блоба. True — файл создан этой миграцией."""
+    if path.exists():
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+    return True
+
+
+def _is_postgres(db: BaseDBAsyncClient) -> bool:
+    return db.capabilities.dialect == "postgres"
+
+
+def _params(db: BaseDBAsyncClient, count: int) -> list[str]:
+    if _is_postgres(db):
+        return [f"${i}" for i in range(1, count + 1)]
+    return ["?"] * count
+
+
+async def _columns(db: BaseDBAsyncClient, table: str) -> set[str]:
+    if _is_postgres(db):
+        _, rows = await db.execute_query(
+            "SELECT column_name AS name FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = $1",
+            [table],
+        )
+    else:
+        _, rows = await db.execute_query(f'PRAGMA table_info("{table}")')
+    return {row["name"] for row in rows}
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    root = _blob_root()
+
+    # Сначала читаем и записываем файлы, затем меняем схему. Если миграция
+    # упадёт, транзакция откатится, а созданные файлы удаляются ниже.
+    images: list[tuple[str, int, str, bytes]] = []
+    for table in ("goals", "checkins"):
+        _, rows = await db.execute_query(
+            f'SELECT "id", "image_base64" FROM "{table}" '
+            'WHERE "image_base64" IS NOT NULL'
+        )
+        for row in rows:
+            data = base64.b64decode(row["image_base64"])
+            images.append((table, row["id"], hashlib.sha256(data).hexdigest(), data))
+
+    created: list[Path] = []
+    try:
+        for _, _, sha256, data in images:
+            path = _blob_path(root, sha256)
+            if _write_blob(path, data):
+                created.append(path)
+        await _move_rows(db, images)
+    except BaseException:
+        for path in created:
+            path.unlink(missing_ok=True)
+        raise
+    return ""
+
+
+async def _move_rows(
+    db: BaseDBAsyncClient, images: list[tuple[str, int, str, bytes]]
+) -> None:
+    await db.execute_script(
+        """
+        CREATE TABLE IF NOT EXISTS "image_blobs" (
+    "sha256" VARCHAR(64) NOT NULL PRIMARY KEY,
+    "size" INT NOT NULL,
+    "ref_count" INT NOT NULL DEFAULT 0,
+    "created_at" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+        ALTER TABLE "checkins" ADD "image_hash" VARCHAR(64);
+        ALTER TABLE "goals" ADD "image_hash" VARCHAR(64);"""
+    )
+
+    # Поля режима были добавлены в модель без миграции — добавляем, если их нет
+    user_columns = await _columns(db, "users")
+    if "current_mode" not in user_columns:
+        await db.execute_script(
+            """ALTER TABLE "users" ADD "current_mode" VARCHAR(20) NOT NULL """
+            """DEFAULT 'normal';"""
+        )
+    if "mode_updated_at" not in user_columns:
+        await db.execute_script('ALTER TABLE "users" ADD "mode_updated_at" TIMESTAMP;')
+
+    refs: Counter[str] = Counter()
+    sizes: dict[str, int] = {}
+    hash_param, id_param = _params(db, 2)
+    for table, row_id, sha256, data in images:
+        refs[sha256] += 1
+        sizes[sha256] = len(data)
+        await db.execute_query(
+            f'UPDATE "{table}" SET "image_hash" = {hash_param} '
+            f'WHERE "id" = {id_param}',
+            [sha256, row_id],
+        )
+
+    insert_params = ", ".join(_params(db, 3))
+    for sha256, count in refs.items():
+        await db.execute_query(
+            'INSERT INTO "image_blobs" ("sha256", "size", "ref_count") '
+            f"VALUES ({insert_params})",
+            [sha256, sizes[sha256], count],
+        )
+
+    await db.execute_script(
+        """
+        ALTER TABLE "checkins" DROP COLUMN "image_base64";
+        ALTER TABLE "goals" DROP COLUMN "image_base64";"""
+    )
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    root = _blob_root()
+
+    await db.execute_script(
+        """
+        ALTER TABLE "checkins" ADD "image_base64" TEXT;
+        ALTER TABLE "goals" ADD "image_base64" TEXT;"""
+    )
+
+    data_param, id_param = _params(db, 2)
+    for table in ("goals", "checkins"):
+        _, rows = await db.execute_query(
+            f'SELECT "id", "image_hash" FROM "{table}" WHERE "image_hash" IS NOT NULL'
+        )
+        for row in rows:
+            path = _blob_path(root, row["image_hash"])
+            if not path.exists():
+                continue
+            await db.execute_query(
+                f'UPDATE "{table}" SET "image_base64" = {data_param} '
+                f'WHERE "id" = {id_param}',
+                [base64.b64encode(path.read_bytes()).decode("utf-8"), row["id"]],
+            )
+
+    return """
+        ALTER TABLE "checkins" DROP COLUMN "image_hash";
+        ALTER TABLE "goals" DROP COLUMN "image_hash";
+        DROP TABLE IF EXISTS "image_blobs";"""
+
+
+MODELS_STATE = (
+    "eJztWltz2jgU/isePyUzaUqMuWTfICUp2wZ2Ena30+2ORtjCeGLLVJaTsF3++0qyjeUbxU"
+    "1CA+sXYc5Fl0+37xz7m+p6JnL804s5Mu6GWP1F+aZi6CL2kFWdKCpcLBIFF1A4dYStwY1s"
+    "LIRw6lMCDcrkM+j4iIlM5BvEXlDb403gwHG40DOYoY2tRBRg+2uAAPUsROeIMMVffzOxjU"
+    "30iPz47+IOzGzkmKne2iZvW8gBXS6EbIjppTDkrU2B4TmBixPjxZLOPby2tjHlUgthRCBF"
+    "vHpKAt593rtopPGIwp4mJmEXJR8TzWDgUGm4U5DIVABG4wm4HUwAUCsAZHiYg8u66ovRW7"
+    "wLb7QzvaN3m229y0xEN9eSzipsOgEmdBTwjCbqSughhaGFwDgBlSlQHtZ3TEptFxVjG/tk"
+    "0DUjp9P4IYt1jOwmsGNBgnaywnYBN0HQHGNnGU3zBmwnw+vB7aR3/RtvzvX9r45ArjcZcI"
+    "0mpMuM9Kh9zOUe2zzhrlpXovw5nLxX+F/l83g0EPB6PrWIaDGxm3xWeZ9gQD2AvQcATWlF"
+    "xtIYNWaZzDRBC49QQNEjzU/4hEmLJzvjlplzht0ezvKmWR18mqQmdPRH7+bife/m6Lr36T"
+    "g1qR/Ho6vYPJnR0cXHcV9sOunkcqGFwBz68zzyF3NISo6wlNcPAR+ti9eCu+rCR+AgbNE5"
+    "+9vWN8xDjHpbz+yYeD40oUrjDG0wQ8icQuOuyhLPuB0C0rte4ZYHHVDpgpY8vn9L78GZ8h"
+    "wXNac+s7vCe5rDlUf30iPItvAHtBQgD1mPIDaKLueI6l1F1ewZuKt49cTSZMcR+LDmivKi"
+    "YmNnI0Y0PGR7txe9dwNVIMz3+QMkJkhBzTWe5mUka9u8ytXcrARidmKb0Sh4n2XUC4h3PB"
+    "vlrJsPqKbch0W5qU2dAs5dTgTWDgdBvtIkQGu1tmABzKqUBghd+jaSe1aBB2Tcah5QM93X"
+    "ynTZPU8DvwrGicfuThGVXVj2PVJ3AnKrsQXIrUYpyFyVBtkgiAMCYEHAvDlDkvas8yT7lC"
+    "cJfESqhTKSRx3KfD+U4XA9Qyjze1TNnoG7bSgjLaqqoYx0gklJ+zTc/cjz8sMNcmAJ5cm/"
+    "HzgQsFcvGe0NOZvpO95ULQj5EuXJprgvZERTZrdd9Kd+CRq61uSl3uFl60w8awr/aXZFKR"
+    "RNJMpQ3RDPYdkWZUuUpuR1HlahKQxFijB9w45Sdtr6yBQKvZWrSfaeJs/6ediCcuQT4y1b"
+    "3ve2gfy3fJDAp2z7ny6Wx6dqZmIPZ2RfsBiKLtUX+k3D5sQYm7JaNKHPku7rmijDIc5Ctz"
+    "NF8usm+iYMazpRpH8hRKmWFIJmbIcEmIaGM6kDcmdaMuyhAikJKlH3oy6LaXxC4sGfQ63V"
+    "rsRv1x7Pw29/bgriRcKH8pSEb/9TkJEoJTyxec121uke+T1btJ0qAJry2R2qjT2BtA7Eyq"
+    "E+rEAsFzb8nIS9iC0K2Fscc5QTN07b64T9gSXsWfBlEegWZgX6tlUKcMbxeQ721wD1uaY1"
+    "mx2t0Wx3W3qn0+o21pjnVZvA7w+vOP6pIyZ//vNNJZ4r8EHZ5/Ayyi/y2mRmE5+CqkCnvW"
+    "qot4K6ZjT/F0aTmvWAEIQp4LyhyhbL+u3wDQ72iBt+pLCDnbbNGxyt/A2OlnuDwwEDwcL8"
+    "wb1W4P4MG+6VnXZ7sr9iTJ4SMqQ/p3piVvzAPqV60ZR4DxHbmKsFEVWkOdkUU8HEpg6qds"
+    "z0XyyoumdxcuH3OeXXoORSfwm1Hc/km6oCwpH5AaJ71tiGXDCrUnSFLsPiw/dGeYR/vR2P"
+    "Sqhc4pKlErZBlX8Vx/b3MYu+AVwORopA5D40y35TlmEGvIJ+0TcFu0wOrv4DZPyNag=="
+)
@@ -0,0 +1,88 @@
+"""
+Бенчмарк записи чек-инов в SQLite: настройки Tortoise по умолчанию
+против профиля из src/database/sqlite.py.
+
+Запуск (из корня проекта):
+    python -m scripts.bench_sqlite_checkins --checkins 2000 --concurrency 50
+
+Каждый профиль пишется в свою временную базу. Параллельно с записью
+идут чтения активных целей — как при обычной работе бота.
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from typing import Any, Dict
+
+from tortoise import Tortoise, connections
+
+from src.database.models import CheckIn, Goal, User
+from src.database.sqlite import sqlite_pragmas, verify_pragmas
+
+# Что Tortoise ставит сам: WAL, но synchronous=FULL (fsync на каждый коммит)
+DEFAULT_PRAGMAS: Dict[str, Any] = {}
+
+
+async def run_profile(
+    name: str, pragmas: Dict[str, Any], checkins: int, concurrency: int
+) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        await Tortoise.init(
+            config={
+                "connections": {
+                    "default": {
+                        "engine": "tortoise.backends.sqlite",
+                        "credentials": {
+                            "file_path": os.path.join(tmp, "bench.sqlite3"),
+                            **pragmas,
+                        },
+                    }
+                },
+                "apps": {"models": {"models": ["src.database.models"]}},
+            }
+        )
+        try:
+            await Tortoise.generate_schemas()
+            if pragmas:
+                await verify_pragmas(connections.get("default"))
+
+            user = await User.create(telegram_id=1, first_name="bench")
+            goal = await Goal.create(user=user, title="Бенчмарк", status="active")
+
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def write(i: int) -> None:
+                async with semaphore:
+                    await CheckIn.create(goal=goal, report_text=f"Отчёт {i}")
+                    await Goal.filter(user_id=user.id, status="active").count()
+
+            started = time.perf_counter()
+            await asyncio.gather(*(write(i) for i in range(checkins)))
+            elapsed = time.perf_counter() - started
+        finally:
+            await Tortoise.close_connections()
+
+    rate = checkins / elapsed
+    print(f"{name:>8}: {checkins} check-ins in {elapsed:.2f}s ({rate:.0f}/s)")
+    return rate
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--checkins", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    before = await run_profile(
+        "default", DEFAULT_PRAGMAS, args.checkins, args.concurrency
+    )
+    after = await run_profile(
+        "tuned", sqlite_pragmas(), args.checkins, args.concurrency
+    )
+    print(f"speedup: x{after / before:.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
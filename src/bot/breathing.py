@@ -0,0 +1,267 @@
+"""
+Планировщик дыхательных упражнений.
+
+AICODE-NOTE: Раньше хендлер сам проходил упражнение цепочкой
+asyncio.sleep + edit_text и держал апдейт (и FSM) 20-30 секунд, а повторное
+нажатие "Повторить" запускало вторую параллельную цепочку. Теперь хендлер
+только ставит сессию в BreathingScheduler и сразу возвращается. Все шаги
+всех пользователей лежат в одной куче по времени срабатывания, её разбирает
+одна фоновая задача. У пользователя не больше одной сессии: новая отменяет
+старую. Завершение (мантра, клавиатура) зависит от раздела бота —
+это именованные finisher'ы, поэтому сессию можно сохранить в JSON
+при остановке и продолжить после рестарта.
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot, types
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед первым шагом, секунды
+LEAD_IN = 1.0
+
+Finisher = Callable[[Bot, int], Awaitable[None]]
+
+# Фазы техник: (текст, длительность в секундах)
+TECHNIQUES: Dict[str, Tuple[Tuple[str, float], ...]] = {
+    "478": (
+        ("🌬 Вдох... (4 секунды)", 4),
+        ("⏸ Задержи... (7 секунд)", 7),
+        ("💨 Выдох... (8 секунд)", 8),
+    ),
+    "box": (
+        ("🌬 Вдох... (4 секунды)", 4),
+        ("⏸ Задержи... (4 секунды)", 4),
+        ("💨 Выдох... (4 секунды)", 4),
+        ("⏸ Задержи... (4 секунды)", 4),
+    ),
+}
+
+# Кнопки выбора техники (action в CrisisCallback/ReflectCallback) и вступления
+CALLBACK_TECHNIQUES: Dict[str, str] = {"b478": "478", "bbox": "box"}
+INTROS: Dict[str, str] = {
+    "478": "🌬 Давай подышим вместе.\n\nТехника 4-7-8:",
+    "box": "⬜ Давай подышим вместе.\n\nBox Breathing 4-4-4-4:",
+}
+
+
+@dataclass
+class BreathingSession:
+    user_id: int
+    chat_id: int
+    technique: str
+    finisher: str
+    # Индекс следующей фазы; len(фаз) — осталось завершение
+    step: int = 0
+    # Время следующего шага (time.time(), чтобы переживать рестарт)
+    due: float = 0.0
+    # Сообщение с текущей фазой, создаётся первым шагом
+    message_id: Optional[int] = None
+
+
+class BreathingScheduler:
+    def __init__(self):
+        self._heap: List[Tuple[float, int, BreathingSession]] = []
+        self._sessions: Dict[int, BreathingSession] = {}
+        self._finishers: Dict[str, Finisher] = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # Запущенные шаги: ссылка нужна, иначе задачу может собрать GC
+        self._steps: Set[asyncio.Task] = set()
+        self._bot: Optional[Bot] = None
+        self.steps_sent = 0
+        self.completed = 0
+        self.failed = 0
+
+    def on_finish(self, name: str) -> Callable[[Finisher], Finisher]:
+        """Регистрирует завершение упражнения для раздела бота."""
+
+        def decorator(func: Finisher) -> Finisher:
+            self._finishers[name] = func
+            return func
+
+        return decorator
+
+    # ---------- Жизненный цикл ----------
+
+    def start(self, bot: Bot) -> None:
+        self._bot = bot
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        steps = list(self._steps)
+        for step in steps:
+            step.cancel()
+        # Прерванные шаги не удаляют сессии — они попадут в save()
+        await asyncio.gather(*steps, return_exceptions=True)
+
+    # ---------- Сессии ----------
+
+    def schedule(
+        self, user_id: int, chat_id: int, technique: str, finisher: str
+    ) -> None:
+        """Запускает упражнение; незавершённое упражнение пользователя отменяется."""
+        session = BreathingSession(
+            user_id=user_id,
+            chat_id=chat_id,
+            technique=technique,
+            finisher=finisher,
+            due=time.time() + LEAD_IN,
+        )
+        self._sessions[user_id] = session
+        self._push(session)
+
+    def cancel(self, user_id: int) -> bool:
+        # Запись в куче остаётся и отбрасывается при извлечении
+        return self._sessions.pop(user_id, None) is not None
+
+    def is_active(self, user_id: int) -> bool:
+        return user_id in self._sessions
+
+    def _push(self, session: BreathingSession) -> None:
+        heapq.heappush(self._heap, (session.due, next(self._counter), session))
+        self._wakeup.set()
+
+    def _is_current(self, session: BreathingSession) -> bool:
+        return self._sessions.get(session.user_id) is session
+
+    async def _run(self) -> None:
+        while True:
+            if not self._heap:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            due, _, session = self._heap[0]
+            if not self._is_current(session):
+                heapq.heappop(self._heap)
+                continue
+
+            delay = due - time.time()
+            if delay > 0:
+                # Просыпаемся раньше, если в кучу добавили более ранний шаг
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            heapq.heappop(self._heap)
+            # Медленный запрос к Telegram не задерживает шаги других пользователей
+            step = asyncio.create_task(self._advance(session))
+            self._steps.add(step)
+            step.add_done_callback(self._steps.discard)
+
+    async def _advance(self, session: BreathingSession) -> None:
+        phases = TECHNIQUES[session.technique]
+        try:
+            if session.step < len(phases):
+                text, duration = phases[session.step]
+                if session.message_id is None:
+                    message = await self._bot.send_message(session.chat_id, text)
+                    session.message_id = message.message_id
+                else:
+                    await self._bot.edit_message_text(
+                        text, chat_id=session.chat_id, message_id=session.message_id
+                    )
+                self.steps_sent += 1
+                session.step += 1
+                session.due = time.time() + duration
+                if self._is_current(session):
+                    self._push(session)
+                return
+
+            if self._is_current(session):
+                del self._sessions[session.user_id]
+                await self._finishers[session.finisher](self._bot, session.chat_id)
+                self.completed += 1
+        except Exception as e:
+            # Сообщение удалено, бот заблокирован и т.п. — упражнение прерываем
+            self.failed += 1
+            if self._is_current(session):
+                del self._sessions[session.user_id]
+            logger.warning(f"Breathing session for {session.user_id} failed: {e}")
+
+    # ---------- Сохранение между рестартами ----------
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [asdict(session) for session in self._sessions.values()]
+
+    def restore(self, items: List[Dict[str, Any]]) -> int:
+        """Продолжает сохранённые сессии; просроченные шаги выполняются сразу."""
+        restored = 0
+        for item in items:
+            session = BreathingSession(**item)
+            if session.technique not in TECHNIQUES:
+                continue
+            if session.finisher not in self._finishers:
+                continue
+            self._sessions[session.user_id] = session
+            self._push(session)
+            restored += 1
+        return restored
+
+    def save(self, path: str) -> None:
+        items = self.snapshot()
+        if items:
+            Path(path).write_text(json.dumps(items), encoding="utf-8")
+            logger.info(f"Saved {len(items)} breathing sessions to {path}")
+
+    def load(self, path: str) -> None:
+        file = Path(path)
+        if not file.exists():
+            return
+        try:
+            restored = self.restore(json.loads(file.read_text(encoding="utf-8")))
+            logger.info(f"Restored {restored} breathing sessions from {path}")
+        except (ValueError, TypeError) as e:
+            logger.error(f"Failed to restore breathing sessions: {e}")
+        file.unlink()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": len(self._sessions),
+            "scheduled": len(self._heap),
+            "steps_sent": self.steps_sent,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+# Singleton instance
+breathing_scheduler = BreathingScheduler()
+
+
+async def start_breathing(
+    callback: types.CallbackQuery,
+    technique: str,
+    finisher: str,
+    intro: Optional[str] = None,
+) -> None:
+    """
+    Общий запуск упражнения для crisis и reflect: показывает вступление и
+    ставит сессию в планировщик — хендлер не ждёт окончания.
+    """
+    await callback.message.edit_text(intro or INTROS[technique])
+    await callback.answer()
+    breathing_scheduler.schedule(
+        user_id=callback.from_user.id,
+        chat_id=callback.message.chat.id,
+        technique=technique,
+        finisher=finisher,
+    )
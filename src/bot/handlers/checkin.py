@@ -1,4 +1,6 @@
 import logging
+from typing import Optional, Sequence
+
 from aiogram import Router, types
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
@@ -6,14 +8,14 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from src.bot.states import CheckInStates
 from src.bot.callbacks import MenuCallback, CheckinCallback
-from src.database.models import Goal, CheckIn, User
-from src.services.ai import ai_service
+from src.bot.streaming import ThrottledMessageEditor
+from src.database.models import CheckIn, User
+from src.database.queries import GoalSummary, get_user_goal_summary
+from src.services.ai import FALLBACK_RESPONSE, ai_service
 from src.services.gif_service import gif_service
-from src.services.vision import (
-    download_telegram_photo,
-    encode_image_to_base64,
-    prepare_vision_payload,
-)
+from src.services.prompts import CHECKIN_PROMPT
+from src.services.photos import photo_service
+from src.services.vision import image_pipeline
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -27,28 +29,26 @@ def get_back_to_menu_keyboard():
 
 
 @router.message(Command("checkin"))
-async def cmd_checkin(message: types.Message, state: FSMContext):
+async def cmd_checkin(
+    message: types.Message,
+    state: FSMContext,
+    db_user: Optional[User] = None,
+    active_goals: Sequence[GoalSummary] = (),
+):
     """Start check-in process by listing active goals."""
-    user_id = message.from_user.id
-
-    # Fetch active goals for the user
-    # We need to join with User to filter by telegram_id
-    # Assuming User exists since they are using the bot (onboarding should ensure this)
-    user = await User.get_or_none(telegram_id=user_id)
-    if not user:
+    # Пользователь и цели уже загружены UserContextMiddleware
+    if not db_user:
         await message.answer("Сначала нужно познакомиться! Нажми /start")
         return
 
-    goals = await Goal.filter(user=user, status="active").all()
-
-    if not goals:
+    if not active_goals:
         await message.answer(
             "У тебя пока нет активных целей. Создай новую через /new_goal"
         )
         return
 
     builder = InlineKeyboardBuilder()
-    for goal in goals:
+    for goal in active_goals:
         # Используем типизированный CallbackData
         builder.button(text=goal.title, callback_data=CheckinCallback(goal_id=goal.id))
 
@@ -69,7 +69,7 @@ async def process_goal_selection(
 
     # AICODE-NOTE: Prevent IDOR by filtering by user__telegram_id
     # Verify goal exists and belongs to user (security check)
-    goal = await Goal.get_or_none(id=goal_id, user__telegram_id=callback.from_user.id)
+    goal = await get_user_goal_summary(goal_id, callback.from_user.id)
 
     if not goal:
         await callback.message.answer("Цель не найдена или у вас нет прав.")
@@ -101,7 +101,7 @@ async def process_goal_selection(
     await callback.answer()
 
 
-@router.message(CheckInStates.waiting_for_report)
+@router.message(CheckInStates.waiting_for_report, flags={"throttle": "ai"})
 async def process_report(message: types.Message, state: FSMContext):
     """Handle the report (text or photo)."""
     data = await state.get_data()
@@ -113,7 +113,7 @@ async def process_report(message: types.Message, state: FSMContext):
         await state.clear()
         return
 
-    goal = await Goal.get_or_none(id=goal_id, user__telegram_id=message.from_user.id)
+    goal = await get_user_goal_summary(goal_id, message.from_user.id)
     if not goal:
         await message.answer(
             "Цель не найдена или у вас нет прав. "
@@ -123,18 +123,21 @@ async def process_report(message: types.Message, state: FSMContext):
         return
 
     report_text = ""
-    image_base64 = None
+    image_url = None
+    image_hash = None
 
     # Handle Photo
     if message.photo:
-        # Get the largest photo
-        photo = message.photo[-1]
         try:
-            image_data = await download_telegram_photo(message.bot, photo.file_id)
-            image_base64 = encode_image_to_base64(image_data)
+            # Уменьшенное JPEG без EXIF (повторное фото берётся из BlobStore)
+            image_bytes, image_hash = await photo_service.load(
+                message.bot, message.photo
+            )
+            image_url = await image_pipeline.encode_data_url(image_bytes)
             report_text = message.caption or "[Фото отчет]"
         except Exception as e:
             logger.error(f"Failed to download photo: {e}")
+            await photo_service.discard(image_hash)
             await message.answer(
                 "Не удалось загрузить фото. Пожалуйста, отправь отчет текстом."
             )
@@ -147,47 +150,42 @@ async def process_report(message: types.Message, state: FSMContext):
         await message.answer("Пожалуйста, пришли текст или фото.")
         return
 
+    # Строка создаётся сразу после загрузки фото: ссылка на блоб не висит
+    # без владельца, пока идёт анализ. Отзыв AI дописывается потом
+    try:
+        checkin = await CheckIn.create(
+            goal_id=goal.id, report_text=report_text, image_hash=image_hash
+        )
+    except Exception:
+        await photo_service.discard(image_hash)
+        raise
+
     wait_msg = await message.answer("Анализирую твой отчет... 🧠")
+    editor = ThrottledMessageEditor(wait_msg)
+
+    # Описание нужно только для AI-анализа — грузим его лениво
+    goal_details = await goal.load_details()
+    description = goal_details.description if goal_details else None
 
     # AI Analysis
+    saved_feedback = None
     try:
-        # Prepare prompt
-        system_prompt = (
-            "Ты - опытный коуч по достижению целей. Твоя задача - поддержать "
-            "пользователя и дать конструктивный совет на основе его отчета."
-        )
-
-        user_content = (
-            f"Цель: {goal.title}\n"
-            f"Описание цели: {goal.description}\n\n"
-            f"Отчет пользователя: {report_text}"
+        messages = CHECKIN_PROMPT.render(
+            images=[image_url] if image_url else None,
+            title=goal.title,
+            description=description,
+            report=report_text,
         )
 
-        messages = [{"role": "system", "content": system_prompt}]
-
-        if image_base64:
-            # Use vision payload
-            vision_messages = prepare_vision_payload(user_content, [image_base64])
-            # Need to merge properly. prepare_vision_payload returns a list
-            messages.extend(vision_messages)
-        else:
-            messages.append({"role": "user", "content": user_content})
-
-        # Add instruction for output format
-        messages.append(
-            {
-                "role": "user",
-                "content": (
-                    "Проанализируй прогресс. Дай краткую обратную связь: "
-                    "1. Похвали за сделанное.\n"
-                    "2. Дай 1 конкретный совет, что можно улучшить или сделать "
-                    "следующим шагом.\n"
-                    "Ответ должен быть мотивирующим, но кратким (до 100 слов)."
-                ),
-            }
+        # Ответ появляется в wait_msg по мере генерации
+        ai_feedback = await editor.stream(
+            ai_service.stream_chat_response(
+                messages, max_tokens=CHECKIN_PROMPT.max_output_tokens
+            )
         )
-
-        ai_feedback = await ai_service.get_chat_response(messages)
+        # Заглушку недоступного AI показываем, но в историю не пишем
+        if ai_feedback != FALLBACK_RESPONSE:
+            saved_feedback = ai_feedback
 
     except Exception as e:
         logger.error(f"Error in AI analysis: {e}")
@@ -196,20 +194,11 @@ async def process_report(message: types.Message, state: FSMContext):
             "(AI временно недоступен для детального анализа)"
         )
 
-    # Save to DB
-    await CheckIn.create(
-        goal=goal,
-        report_text=report_text,
-        image_base64=image_base64,
-        ai_feedback=ai_feedback,
-    )
-
-    try:
-        await wait_msg.delete()
-    except Exception:
-        pass  # Ignore deletion errors to ensure state is cleared
+    if saved_feedback:
+        checkin.ai_feedback = saved_feedback
+        await checkin.save(update_fields=["ai_feedback"])
 
-    await message.answer(f"✅ Записано!\n\n{ai_feedback}")
+    await editor.finish(f"✅ Записано!\n\n{ai_feedback}")
     
     # Отправляем GIF по настроению (чек-ин = маленькая победа)
     await gif_service.send_mood_gif(
@@ -11,18 +11,25 @@ AICODE-NOTE: Режим кризиса — не замена профессио
 В будущем добавить ресурсы (горячие линии) для тяжёлых случаев.
 """
 
-import asyncio
 import logging
 from datetime import datetime
+from typing import Optional, Sequence
 
-from aiogram import Router, F, types
+from aiogram import Bot, Router, F, types
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from src.bot.breathing import (
+    CALLBACK_TECHNIQUES,
+    breathing_scheduler,
+    start_breathing,
+)
 from src.bot.states import CrisisStates
 from src.bot.callbacks import CrisisCallback
-from src.database.models import User, Goal
+from src.bot.middlewares import invalidate_user_context, load_user_context
+from src.database.models import User
+from src.database.queries import GoalSummary
 from src.data.mantras import get_random_mantra
 from src.services.gif_service import gif_service
 
@@ -33,23 +40,31 @@ logger = logging.getLogger(__name__)
 # ============== Вспомогательные функции ==============
 
 
-async def send_gif_if_available(
-    message: types.Message, category: str, caption: str = None
+async def send_gif_to_chat(
+    bot: Bot, chat_id: int, category: str, caption: str = None
 ):
     """
-    Отправляет GIF из категории, если он доступен.
+    Отправляет GIF из категории в чат, если он доступен.
     Если GIF нет — просто пропускает (graceful fallback).
+    Нужна там, где нет входящего сообщения (finisher'ы планировщика).
     """
     file_id = gif_service.get_random(category)
     if file_id:
         try:
-            await message.answer_animation(animation=file_id, caption=caption)
+            await bot.send_animation(chat_id, animation=file_id, caption=caption)
             return True
         except Exception as e:
             logger.warning(f"Failed to send GIF from {category}: {e}")
     return False
 
 
+async def send_gif_if_available(
+    message: types.Message, category: str, caption: str = None
+):
+    """Отправляет GIF из категории в чат сообщения (см. send_gif_to_chat)."""
+    return await send_gif_to_chat(message.bot, message.chat.id, category, caption)
+
+
 def get_crisis_menu_keyboard():
     """Клавиатура главного меню кризис-режима."""
     builder = InlineKeyboardBuilder()
@@ -125,12 +140,14 @@ def get_exit_crisis_keyboard():
 
 
 @router.message(Command("crisis"))
-async def cmd_crisis(message: types.Message, state: FSMContext):
+async def cmd_crisis(
+    message: types.Message, state: FSMContext, db_user: Optional[User] = None
+):
     """
     Вход в режим кризиса.
     Переключает пользователя в режим поддержки.
     """
-    user = await User.get_or_none(telegram_id=message.from_user.id)
+    user = db_user
 
     if not user:
         await message.answer("Сначала нужно познакомиться! Нажми /start")
@@ -140,6 +157,7 @@ async def cmd_crisis(message: types.Message, state: FSMContext):
     user.current_mode = "crisis"
     user.mode_updated_at = datetime.now()
     await user.save()
+    invalidate_user_context(user.telegram_id)
 
     # Отправляем GIF поддержки (если есть)
     await send_gif_if_available(message, "support")
@@ -155,10 +173,11 @@ async def cmd_crisis(message: types.Message, state: FSMContext):
 # ============== Главное меню кризиса ==============
 
 
-async def _verify_crisis_mode(callback: types.CallbackQuery) -> bool:
+async def _verify_crisis_mode(
+    callback: types.CallbackQuery, db_user: Optional[User]
+) -> bool:
     """Проверяет, что пользователь в режиме кризиса."""
-    user = await User.get_or_none(telegram_id=callback.from_user.id)
-    if not user or user.current_mode != "crisis":
+    if not db_user or db_user.current_mode != "crisis":
         await callback.answer(
             "Режим кризиса не активен. Используй /crisis чтобы войти.", show_alert=True
         )
@@ -167,9 +186,11 @@ async def _verify_crisis_mode(callback: types.CallbackQuery) -> bool:
 
 
 @router.callback_query(CrisisCallback.filter(F.action == "breathe"))
-async def handle_breathe_choice(callback: types.CallbackQuery, state: FSMContext):
+async def handle_breathe_choice(
+    callback: types.CallbackQuery, state: FSMContext, db_user: Optional[User] = None
+):
     """Пользователь хочет подышать — показываем выбор техники."""
-    if not await _verify_crisis_mode(callback):
+    if not await _verify_crisis_mode(callback, db_user):
         return
 
     try:
@@ -185,9 +206,11 @@ async def handle_breathe_choice(callback: types.CallbackQuery, state: FSMContext
 
 
 @router.callback_query(CrisisCallback.filter(F.action == "talk"))
-async def handle_talk(callback: types.CallbackQuery, state: FSMContext):
+async def handle_talk(
+    callback: types.CallbackQuery, state: FSMContext, db_user: Optional[User] = None
+):
     """Пользователь хочет написать что чувствует."""
-    if not await _verify_crisis_mode(callback):
+    if not await _verify_crisis_mode(callback, db_user):
         return
 
     try:
@@ -206,9 +229,11 @@ async def handle_talk(callback: types.CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(CrisisCallback.filter(F.action == "just_be"))
-async def handle_just_be(callback: types.CallbackQuery, state: FSMContext):
+async def handle_just_be(
+    callback: types.CallbackQuery, state: FSMContext, db_user: Optional[User] = None
+):
     """Пользователь хочет просто побыть."""
-    if not await _verify_crisis_mode(callback):
+    if not await _verify_crisis_mode(callback, db_user):
         return
 
     # Отправляем GIF отдыха если есть
@@ -270,87 +295,25 @@ async def handle_just_being_message(message: types.Message, state: FSMContext):
 
 
 @router.callback_query(
-    CrisisStates.breathing, CrisisCallback.filter(F.action == "b478")
-)
-async def start_breathing_478(callback: types.CallbackQuery, state: FSMContext):
-    """Запуск техники 4-7-8."""
-    await state.update_data(breathing_technique="478")
-    await callback.message.edit_text("🌬 Давай подышим вместе.\n\nТехника 4-7-8:")
-    await callback.answer()
-    await run_breathing_478(callback.message, state)
-
-
-@router.callback_query(
-    CrisisStates.breathing, CrisisCallback.filter(F.action == "bbox")
+    CrisisStates.breathing, CrisisCallback.filter(F.action.in_(CALLBACK_TECHNIQUES))
 )
-async def start_breathing_box(callback: types.CallbackQuery, state: FSMContext):
-    """Запуск Box Breathing 4-4-4-4."""
-    await state.update_data(breathing_technique="box")
-    await callback.message.edit_text(
-        "⬜ Давай подышим вместе.\n\nBox Breathing 4-4-4-4:"
-    )
-    await callback.answer()
-    await run_breathing_box(callback.message, state)
-
-
-async def run_breathing_478(message: types.Message, state: FSMContext):
-    """
-    Выполнение дыхательной техники 4-7-8.
-    Вдох 4с → Задержка 7с → Выдох 8с
-    """
-    await asyncio.sleep(1)
-
-    # Вдох
-    inhale_msg = await message.answer("🌬 Вдох... (4 секунды)")
-    await asyncio.sleep(4)
-
-    # Задержка
-    await inhale_msg.edit_text("⏸ Задержи... (7 секунд)")
-    await asyncio.sleep(7)
-
-    # Выдох
-    await inhale_msg.edit_text("💨 Выдох... (8 секунд)")
-    await asyncio.sleep(8)
-
-    # Отправляем GIF дыхания (если есть)
-    await send_gif_if_available(message, "breathe")
-
-    mantra = get_random_mantra("breathing")
-    await message.answer(
-        f"✨ Отлично.\n\n_{mantra}_\n\nЕщё раз?",
-        parse_mode="Markdown",
-        reply_markup=get_breathing_repeat_keyboard(),
-    )
-
-
-async def run_breathing_box(message: types.Message, state: FSMContext):
-    """
-    Выполнение Box Breathing 4-4-4-4.
-    Более простой вариант для тех, кому 4-7-8 сложно.
-    """
-    await asyncio.sleep(1)
-
-    # Вдох
-    inhale_msg = await message.answer("🌬 Вдох... (4 секунды)")
-    await asyncio.sleep(4)
-
-    # Задержка 1
-    await inhale_msg.edit_text("⏸ Задержи... (4 секунды)")
-    await asyncio.sleep(4)
-
-    # Выдох
-    await inhale_msg.edit_text("💨 Выдох... (4 секунды)")
-    await asyncio.sleep(4)
+async def start_breathing_technique(
+    callback: types.CallbackQuery, callback_data: CrisisCallback, state: FSMContext
+):
+    """Запуск выбранной техники (4-7-8 или Box Breathing)."""
+    technique = CALLBACK_TECHNIQUES[callback_data.action]
+    await state.update_data(breathing_technique=technique)
+    await start_breathing(callback, technique, finisher="crisis")
 
-    # Задержка 2
-    await inhale_msg.edit_text("⏸ Задержи... (4 секунды)")
-    await asyncio.sleep(4)
 
-    # Отправляем GIF дыхания (если есть)
-    await send_gif_if_available(message, "breathe")
+@breathing_scheduler.on_finish("crisis")
+async def finish_breathing(bot: Bot, chat_id: int):
+    """Завершение упражнения в режиме кризиса: GIF, мантра и выбор."""
+    await send_gif_to_chat(bot, chat_id, "breathe")
 
     mantra = get_random_mantra("breathing")
-    await message.answer(
+    await bot.send_message(
+        chat_id,
         f"✨ Отлично.\n\n_{mantra}_\n\nЕщё раз?",
         parse_mode="Markdown",
         reply_markup=get_breathing_repeat_keyboard(),
@@ -365,13 +328,10 @@ async def repeat_breathing(callback: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
     technique = data.get("breathing_technique", "478")
 
-    await callback.message.edit_text("🌬 Ещё один цикл...")
-    await callback.answer()
-
-    if technique == "box":
-        await run_breathing_box(callback.message, state)
-    else:
-        await run_breathing_478(callback.message, state)
+    # Незавершённый цикл (повторное нажатие) отменяется
+    await start_breathing(
+        callback, technique, finisher="crisis", intro="🌬 Ещё один цикл..."
+    )
 
 
 @router.callback_query(
@@ -379,6 +339,7 @@ async def repeat_breathing(callback: types.CallbackQuery, state: FSMContext):
 )
 async def breathing_done(callback: types.CallbackQuery, state: FSMContext):
     """Пользователь закончил дышать — предлагаем микро-действие."""
+    breathing_scheduler.cancel(callback.from_user.id)
     mantra = get_random_mantra("breathing")
 
     await callback.message.edit_text(
@@ -395,9 +356,14 @@ async def breathing_done(callback: types.CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(CrisisCallback.filter(F.action == "micro"))
-async def offer_micro_action(callback: types.CallbackQuery, state: FSMContext):
+async def offer_micro_action(
+    callback: types.CallbackQuery,
+    state: FSMContext,
+    db_user: Optional[User] = None,
+    active_goals: Sequence[GoalSummary] = (),
+):
     """Предложение микро-действия."""
-    user = await User.get_or_none(telegram_id=callback.from_user.id)
+    user = db_user
     if not user:
         await callback.answer("Ошибка", show_alert=True)
         return
@@ -409,8 +375,8 @@ async def offer_micro_action(callback: types.CallbackQuery, state: FSMContext):
         )
         return
 
-    # Ищем активную цель
-    goal = await Goal.filter(user=user, status="active").first()
+    # Первая активная цель
+    goal = active_goals[0] if active_goals else None
 
     if goal:
         text = (
@@ -490,11 +456,14 @@ async def micro_action_skip(callback: types.CallbackQuery, state: FSMContext):
 
 
 @router.message(CrisisStates.micro_action)
-async def handle_micro_action_message(message: types.Message, state: FSMContext):
+async def handle_micro_action_message(
+    message: types.Message,
+    state: FSMContext,
+    active_goals: Sequence[GoalSummary] = (),
+):
     """Пользователь написал в режиме микро-действия."""
     # Направляем на попытку
-    user = await User.get_or_none(telegram_id=message.from_user.id)
-    goal = await Goal.filter(user=user, status="active").first() if user else None
+    goal = active_goals[0] if active_goals else None
 
     if goal:
         text = (
@@ -532,9 +501,11 @@ async def handle_micro_report(message: types.Message, state: FSMContext):
 
 
 @router.message(Command("normal"))
-async def cmd_normal(message: types.Message, state: FSMContext):
+async def cmd_normal(
+    message: types.Message, state: FSMContext, db_user: Optional[User] = None
+):
     """Ручной выход из режима кризиса."""
-    user = await User.get_or_none(telegram_id=message.from_user.id)
+    user = db_user
 
     if not user:
         await message.answer("Сначала нужно познакомиться! Нажми /start")
@@ -550,14 +521,18 @@ async def cmd_normal(message: types.Message, state: FSMContext):
 
 
 @router.callback_query(CrisisCallback.filter(F.action == "exit_y"))
-async def confirm_exit_crisis(callback: types.CallbackQuery, state: FSMContext):
+async def confirm_exit_crisis(
+    callback: types.CallbackQuery, state: FSMContext, db_user: Optional[User] = None
+):
     """Подтверждение выхода из режима кризиса с GIF."""
-    user = await User.get_or_none(telegram_id=callback.from_user.id)
+    breathing_scheduler.cancel(callback.from_user.id)
+    user = db_user
 
     if user:
         user.current_mode = "normal"
         user.mode_updated_at = datetime.now()
         await user.save()
+        invalidate_user_context(user.telegram_id)
 
     mantra = get_random_mantra("exit")
 
@@ -598,7 +573,7 @@ async def is_user_in_crisis(telegram_id: int) -> bool:
     Проверяет, находится ли пользователь в режиме кризиса.
     Используется другими handlers для смягчения тона.
     """
-    user = await User.get_or_none(telegram_id=telegram_id)
+    user = (await load_user_context(telegram_id)).user
     if user:
         return user.current_mode == "crisis"
     return False
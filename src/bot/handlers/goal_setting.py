@@ -7,12 +7,12 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from src.database.models import User, Goal
 from src.bot.states import GoalSettingStates
 from src.bot.callbacks import MenuCallback
+from src.bot.middlewares import invalidate_user_context
+from src.bot.streaming import ThrottledMessageEditor
 from src.services.ai import ai_service
-from src.services.vision import (
-    download_telegram_photo,
-    encode_image_to_base64,
-    prepare_vision_payload,
-)
+from src.services.prompts import GOAL_PLAN_PROMPT
+from src.services.photos import photo_service
+from src.services.vision import image_pipeline
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -56,35 +56,45 @@ async def process_description(message: types.Message, state: FSMContext):
     await state.set_state(GoalSettingStates.waiting_for_photo)
 
 
-@router.message(StateFilter(GoalSettingStates.waiting_for_photo), Command("skip"))
+@router.message(
+    StateFilter(GoalSettingStates.waiting_for_photo),
+    Command("skip"),
+    flags={"throttle": "ai"},
+)
 async def process_photo_skip(message: types.Message, state: FSMContext):
     """Handle skip photo."""
-    await finalize_goal(message, state, photo_base64=None)
+    await finalize_goal(message, state, photo_url=None, image_hash=None)
 
 
-@router.message(StateFilter(GoalSettingStates.waiting_for_photo), F.photo)
+@router.message(
+    StateFilter(GoalSettingStates.waiting_for_photo), F.photo, flags={"throttle": "ai"}
+)
 async def process_photo(message: types.Message, state: FSMContext):
     """Handle photo upload."""
-    # Get the largest photo
-    photo = message.photo[-1]
-
+    image_hash = None
     try:
-        # Download and convert
-        image_data = await download_telegram_photo(message.bot, photo.file_id)
-        base64_img = encode_image_to_base64(image_data)
-
-        await finalize_goal(message, state, photo_base64=base64_img)
+        # Prepared JPEG (repeated photos are reused from the blob store)
+        image_bytes, image_hash = await photo_service.load(message.bot, message.photo)
+        image_url = await image_pipeline.encode_data_url(image_bytes)
     except Exception as e:
         logger.error(f"Error processing photo: {e}")
+        await photo_service.discard(image_hash)
         await message.answer(f"Ошибка при обработке фото: {e}. Попробуем без него.")
-        await finalize_goal(message, state, photo_base64=None)
+        await finalize_goal(message, state, photo_url=None, image_hash=None)
+        return
+
+    await finalize_goal(message, state, photo_url=image_url, image_hash=image_hash)
 
 
 async def finalize_goal(
-    message: types.Message, state: FSMContext, photo_base64: str | None
+    message: types.Message,
+    state: FSMContext,
+    photo_url: str | None,
+    image_hash: str | None,
 ):
     """
     Finalize goal creation: save to DB and get AI feedback.
+    Owns the blob reference for image_hash: it is released if no Goal is created.
     """
     data = await state.get_data()
     title = data.get("title")
@@ -93,6 +103,7 @@ async def finalize_goal(
 
     # Validate data integrity
     if not title:
+        await photo_service.discard(image_hash)
         await message.answer(
             "Произошла ошибка: заголовок цели не найден. "
             "Попробуй создать цель заново через /new_goal"
@@ -103,46 +114,45 @@ async def finalize_goal(
     # Safely get user
     user = await User.get_or_none(telegram_id=telegram_id)
     if not user:
+        await photo_service.discard(image_hash)
         await message.answer("Пользователь не найден. Нажми /start")
         await state.clear()
         return
 
+    # Save to DB before any Telegram calls, so the photo reference has an owner
+    try:
+        await Goal.create(
+            user=user,
+            title=title,
+            description=description,
+            image_hash=image_hash,
+            status="active",
+        )
+    except Exception:
+        await photo_service.discard(image_hash)
+        raise
+    invalidate_user_context(telegram_id)
+
     # Notify user that we are thinking
     processing_msg = await message.answer(
         "Анализирую твою цель и готовлю план действий..."
     )
 
     # Prepare AI Prompt
-    system_prompt = (
-        "Ты — опытный и эмпатичный коуч. Твоя задача — вдохновить пользователя "
-        "и дать 3 первых шага к цели."
-    )
-    user_text = (
-        f"Моя цель: {title}\n"
-        f"Описание: {description or 'Без описания'}\n\n"
-        "Дай мне мотивирующий пинок и 3 простых шага для начала."
-    )
-
-    messages = [{"role": "system", "content": system_prompt}]
-
-    if photo_base64:
-        # Use Vision
-        vision_payload = prepare_vision_payload(user_text, [photo_base64])
-        messages.extend(vision_payload)
-    else:
-        messages.append({"role": "user", "content": user_text})
-
-    # Save to DB
-    await Goal.create(
-        user=user,
+    messages = GOAL_PLAN_PROMPT.render(
+        images=[photo_url] if photo_url else None,
         title=title,
-        description=description,
-        image_base64=photo_base64,
-        status="active",
+        description=description or "Без описания",
     )
 
+    editor = ThrottledMessageEditor(processing_msg)
     try:
-        ai_response = await ai_service.get_chat_response(messages)
+        # План появляется в processing_msg по мере генерации
+        ai_response = await editor.stream(
+            ai_service.stream_chat_response(
+                messages, max_tokens=GOAL_PLAN_PROMPT.max_output_tokens
+            )
+        )
     except Exception as e:
         logger.error(f"Error getting AI response: {e}")
         ai_response = (
@@ -150,13 +160,7 @@ async def finalize_goal(
             "но я верю в тебя! Начни с малого."
         )
 
-    # Delete processing message and send result
-    try:
-        await processing_msg.delete()
-    except Exception:
-        pass  # Ignore deletion errors
-
-    await message.answer(ai_response)
+    await editor.finish(ai_response)
     await message.answer(
         f"✅ Цель «{title}» успешно сохранена!",
         reply_markup=get_back_to_menu_keyboard(),
@@ -4,6 +4,7 @@ from aiogram.filters import StateFilter
 
 from src.database.models import User, Goal
 from src.bot.states import OnboardingStates
+from src.bot.middlewares import invalidate_user_context
 
 router = Router()
 
@@ -28,6 +29,7 @@ async def process_name(message: types.Message, state: FSMContext):
     else:
         user.first_name = name
         await user.save()
+    invalidate_user_context(telegram_id)
 
     await message.answer(
         f"Приятно познакомиться, {name}!\n\n"
@@ -58,6 +60,7 @@ async def process_main_goal(message: types.Message, state: FSMContext):
         description=f"Главная цель: {goal_title}",
         status="active",
     )
+    invalidate_user_context(telegram_id)
 
     await message.answer(
         "Отличная цель! Я сохранил её.\n\n"
@@ -11,19 +11,27 @@ AICODE-NOTE: Режим /reflect — stateless в MVP (не сохраняем 
 В будущем можно добавить ReflectSession для истории.
 """
 
-import asyncio
 import logging
+from typing import Optional
 
-from aiogram import Router, F, types
+from aiogram import Bot, Router, F, types
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from src.bot.breathing import (
+    CALLBACK_TECHNIQUES,
+    breathing_scheduler,
+    start_breathing,
+)
 from src.bot.states import ReflectStates
 from src.bot.callbacks import MenuCallback, ReflectCallback
+from src.bot.streaming import ThrottledMessageEditor
 from src.database.models import User
 from src.services.ai import ai_service
 from src.services.gif_service import gif_service
+from src.services.prompts import REFLECT_PROMPT
+from src.services.rate_limiter import Priority
 from src.data.mantras import get_random_mantra
 
 router = Router()
@@ -118,36 +126,6 @@ def get_breathing_choice_keyboard():
 # ============== LLM Промпт ==============
 
 
-REFLECT_SYSTEM_PROMPT = """\
-Ты — эмпатичный коуч и психолог. Пользователь только что прошёл \
-сессию саморефлексии и ответил на вопросы о своём состоянии.
-
-Твоя задача:
-1. Проанализировать ответы и понять эмоциональное состояние человека
-2. Выявить ключевой паттерн или блок, который мешает двигаться
-3. Дать 2-3 персонализированные рекомендации
-
-Правила:
-- Используй тёплый, поддерживающий тон
-- Не читай мораль, не давай банальных советов
-- Опирайся на конкретные слова пользователя
-- Рекомендации должны быть практичными и выполнимыми сегодня
-- Длина ответа: 3-5 абзацев максимум
-- Используй эмодзи умеренно
-
-Формат ответа:
-[Краткий анализ состояния — 1-2 предложения]
-
-[Что я заметил/паттерн — 1-2 предложения]
-
-Мои рекомендации:
-1. [Конкретное действие]
-2. [Конкретное действие]
-3. [Опционально: третья рекомендация]
-
-[Тёплое завершение — 1 предложение]"""
-
-
 def format_user_answers(answers: dict) -> str:
     """Форматирует ответы пользователя для LLM."""
     lines = []
@@ -171,12 +149,12 @@ def format_user_answers(answers: dict) -> str:
 # ============== Команда /reflect ==============
 
 
-@router.message(Command("reflect"))
-async def cmd_reflect(message: types.Message, state: FSMContext):
+@router.message(Command("reflect"), flags={"throttle": "ai"})
+async def cmd_reflect(
+    message: types.Message, state: FSMContext, db_user: Optional[User] = None
+):
     """Запуск сессии рефлексии."""
-    user = await User.get_or_none(telegram_id=message.from_user.id)
-
-    if not user:
+    if not db_user:
         await message.answer("Сначала нужно познакомиться! Нажми /start")
         return
 
@@ -276,7 +254,7 @@ async def handle_q6(message: types.Message, state: FSMContext):
     await process_answer_and_next(message, state, "q6_what_helped", message.text)
 
 
-@router.message(ReflectStates.q7_one_step)
+@router.message(ReflectStates.q7_one_step, flags={"throttle": "ai"})
 async def handle_q7(message: types.Message, state: FSMContext):
     await process_answer_and_next(message, state, "q7_one_step", message.text)
 
@@ -333,40 +311,50 @@ async def handle_cancel(callback: types.CallbackQuery, state: FSMContext):
 # ============== LLM Анализ ==============
 
 
+async def send_analysis_unavailable(message: types.Message, state: FSMContext):
+    """Ответ, когда AI-анализ не получился."""
+    await message.answer(
+        "😔 Не получилось проанализировать сейчас.\n\n"
+        "Но само то, что ты ответил на эти вопросы — уже шаг.\n\n"
+        "Хочешь подышать или записать свой шаг?",
+        reply_markup=get_post_reflect_keyboard(),
+    )
+    await state.set_state(ReflectStates.post_reflect)
+
+
 async def run_llm_analysis(message: types.Message, state: FSMContext):
     """Отправляет ответы в LLM и получает рекомендации."""
     data = await state.get_data()
     answers = data.get("reflect_answers", {})
 
+    # OpenAI недоступен (circuit breaker разомкнут) — не держим пользователя
+    # на заглушке «Анализирую...»
+    if not ai_service.is_available():
+        await send_analysis_unavailable(message, state)
+        return
+
     # Показываем typing и мантру
     mantra = get_random_mantra("reflect")
     processing_msg = await message.answer(
         f"🧠 Анализирую твои ответы...\n\n" f"_{mantra}_", parse_mode="Markdown"
     )
 
-    # Формируем промпт
-    user_content = (
-        f"Ответы пользователя на вопросы рефлексии:\n\n{format_user_answers(answers)}"
-    )
-
-    messages = [
-        {"role": "system", "content": REFLECT_SYSTEM_PROMPT},
-        {"role": "user", "content": user_content},
-    ]
+    # Формируем промпт (system-часть статична, см. src/services/prompts.py)
+    messages = REFLECT_PROMPT.render(answers=format_user_answers(answers))
 
+    editor = ThrottledMessageEditor(processing_msg)
     try:
-        response = await ai_service.get_chat_response(
-            messages, temperature=0.7, max_tokens=800
+        # Во время генерации показываем текст без разметки
+        response = await editor.stream(
+            ai_service.stream_chat_response(
+                messages,
+                priority=Priority.HIGH,
+                temperature=0.7,
+                max_tokens=REFLECT_PROMPT.max_output_tokens,
+            )
         )
 
-        # Удаляем сообщение "анализирую"
-        try:
-            await processing_msg.delete()
-        except Exception:
-            pass
-
-        # Отправляем результат
-        await message.answer(
+        await editor.finish(
             f"🧘 *Результаты рефлексии*\n\n{response}",
             parse_mode="Markdown",
             reply_markup=get_post_reflect_keyboard(),
@@ -382,13 +370,7 @@ async def run_llm_analysis(message: types.Message, state: FSMContext):
         except Exception:
             pass
 
-        await message.answer(
-            "😔 Не получилось проанализировать сейчас.\n\n"
-            "Но само то, что ты ответил на эти вопросы — уже шаг.\n\n"
-            "Хочешь подышать или записать свой шаг?",
-            reply_markup=get_post_reflect_keyboard(),
-        )
-        await state.set_state(ReflectStates.post_reflect)
+        await send_analysis_unavailable(message, state)
 
 
 # ============== Post-reflect действия ==============
@@ -406,78 +388,27 @@ async def handle_breathe_choice(callback: types.CallbackQuery, state: FSMContext
 
 
 @router.callback_query(
-    ReflectStates.post_reflect, ReflectCallback.filter(F.action == "b478")
+    ReflectStates.post_reflect,
+    ReflectCallback.filter(F.action.in_(CALLBACK_TECHNIQUES)),
 )
-async def start_breathing_478(callback: types.CallbackQuery, state: FSMContext):
-    """Запуск техники 4-7-8."""
-    await callback.message.edit_text("🌬 Давай подышим вместе.\n\nТехника 4-7-8:")
-    await callback.answer()
-    await run_breathing_478(callback.message, state)
-
-
-@router.callback_query(
-    ReflectStates.post_reflect, ReflectCallback.filter(F.action == "bbox")
-)
-async def start_breathing_box(callback: types.CallbackQuery, state: FSMContext):
-    """Запуск Box Breathing 4-4-4-4."""
-    await callback.message.edit_text(
-        "⬜ Давай подышим вместе.\n\nBox Breathing 4-4-4-4:"
-    )
-    await callback.answer()
-    await run_breathing_box(callback.message, state)
-
-
-async def run_breathing_478(message: types.Message, state: FSMContext):
-    """
-    Выполнение дыхательной техники 4-7-8.
-    AICODE-NOTE: Реюз логики из crisis.py, но без привязки к crisis mode.
-    """
-    await asyncio.sleep(1)
-
-    # Вдох
-    inhale_msg = await message.answer("🌬 Вдох... (4 секунды)")
-    await asyncio.sleep(4)
-
-    # Задержка
-    await inhale_msg.edit_text("⏸ Задержи... (7 секунд)")
-    await asyncio.sleep(7)
-
-    # Выдох
-    await inhale_msg.edit_text("💨 Выдох... (8 секунд)")
-    await asyncio.sleep(8)
-
-    mantra = get_random_mantra("breathing")
-    await message.answer(
-        f"✨ Отлично.\n\n_{mantra}_",
-        parse_mode="Markdown",
-        reply_markup=get_post_reflect_keyboard(),
-    )
+async def start_breathing_technique(
+    callback: types.CallbackQuery, callback_data: ReflectCallback
+):
+    """Запуск выбранной техники (4-7-8 или Box Breathing)."""
+    technique = CALLBACK_TECHNIQUES[callback_data.action]
+    await start_breathing(callback, technique, finisher="reflect")
 
 
-async def run_breathing_box(message: types.Message, state: FSMContext):
+@breathing_scheduler.on_finish("reflect")
+async def finish_breathing(bot: Bot, chat_id: int):
     """
-    Выполнение Box Breathing 4-4-4-4.
+    Завершение упражнения после рефлексии.
+    AICODE-NOTE: Фазы общие с crisis.py (src/bot/breathing.py), без привязки
+    к crisis mode — возвращаем к действиям после рефлексии.
     """
-    await asyncio.sleep(1)
-
-    # Вдох
-    inhale_msg = await message.answer("🌬 Вдох... (4 секунды)")
-    await asyncio.sleep(4)
-
-    # Задержка 1
-    await inhale_msg.edit_text("⏸ Задержи... (4 секунды)")
-    await asyncio.sleep(4)
-
-    # Выдох
-    await inhale_msg.edit_text("💨 Выдох... (4 секунды)")
-    await asyncio.sleep(4)
-
-    # Задержка 2
-    await inhale_msg.edit_text("⏸ Задержи... (4 секунды)")
-    await asyncio.sleep(4)
-
     mantra = get_random_mantra("breathing")
-    await message.answer(
+    await bot.send_message(
+        chat_id,
         f"✨ Отлично.\n\n_{mantra}_",
         parse_mode="Markdown",
         reply_markup=get_post_reflect_keyboard(),
@@ -523,6 +454,7 @@ async def handle_save_step(callback: types.CallbackQuery, state: FSMContext):
 )
 async def handle_done(callback: types.CallbackQuery, state: FSMContext):
     """Завершение сессии рефлексии с GIF по настроению."""
+    breathing_scheduler.cancel(callback.from_user.id)
     data = await state.get_data()
     answers = data.get("reflect_answers", {})
     
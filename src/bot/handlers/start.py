@@ -1,9 +1,12 @@
+from typing import Optional, Sequence
+
 from aiogram import Router, F, types
 from aiogram.filters import CommandStart, Command
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 
-from src.database.models import User, Goal
+from src.database.models import User
+from src.database.queries import GoalSummary
 from src.bot.states import (
     OnboardingStates,
     GoalSettingStates,
@@ -12,6 +15,7 @@ from src.bot.states import (
     ReflectStates,
 )
 from src.bot.callbacks import MenuCallback, CheckinCallback
+from src.bot.middlewares import invalidate_user_context
 
 router = Router()
 
@@ -45,7 +49,12 @@ def get_main_menu_keyboard(has_goals: bool = False):
 
 
 @router.message(CommandStart())
-async def cmd_start(message: types.Message, state: FSMContext):
+async def cmd_start(
+    message: types.Message,
+    state: FSMContext,
+    db_user: Optional[User] = None,
+    active_goals: Sequence[GoalSummary] = (),
+):
     """
     Handle /start command.
     Checks if user exists. If not, starts onboarding.
@@ -54,14 +63,14 @@ async def cmd_start(message: types.Message, state: FSMContext):
     username = message.from_user.username
     first_name = message.from_user.first_name
 
-    # Check if user exists
-    user = await User.get_or_none(telegram_id=telegram_id)
+    user = db_user
 
     if not user:
         # Create new user immediately to store basic info
         user = await User.create(
             telegram_id=telegram_id, username=username, first_name=first_name
         )
+        invalidate_user_context(telegram_id)
         await message.answer(
             f"Привет, {first_name or 'друг'}! Я твой AI-коуч.\n"
             "Давай познакомимся. Как мне тебя называть?",
@@ -72,8 +81,7 @@ async def cmd_start(message: types.Message, state: FSMContext):
         # Clear any previous state to avoid getting stuck
         await state.clear()
 
-        # Check if user has active goals
-        has_goals = await Goal.filter(user=user, status="active").exists()
+        has_goals = bool(active_goals)
 
         display_name = user.first_name or message.from_user.first_name or "друг"
         await message.answer(
@@ -86,23 +94,25 @@ async def cmd_start(message: types.Message, state: FSMContext):
 
 
 @router.message(Command("menu"))
-async def cmd_menu(message: types.Message, state: FSMContext):
+async def cmd_menu(
+    message: types.Message,
+    state: FSMContext,
+    db_user: Optional[User] = None,
+    active_goals: Sequence[GoalSummary] = (),
+):
     """
     Показать главное меню.
     """
-    user = await User.get_or_none(telegram_id=message.from_user.id)
-
-    if not user:
+    if not db_user:
         await message.answer("Сначала нужно познакомиться! Нажми /start")
         return
 
     # Clear any previous state
     await state.clear()
 
-    # Check if user has active goals
-    has_goals = await Goal.filter(user=user, status="active").exists()
+    has_goals = bool(active_goals)
 
-    display_name = user.first_name or message.from_user.first_name or "друг"
+    display_name = db_user.first_name or message.from_user.first_name or "друг"
     await message.answer(
         f"📋 *Главное меню*\n\n" f"Привет, {display_name}! Выбери действие:",
         parse_mode="Markdown",
@@ -114,9 +124,14 @@ async def cmd_menu(message: types.Message, state: FSMContext):
 
 
 @router.message(F.text == "📋 Меню")
-async def handle_menu_button(message: types.Message, state: FSMContext):
+async def handle_menu_button(
+    message: types.Message,
+    state: FSMContext,
+    db_user: Optional[User] = None,
+    active_goals: Sequence[GoalSummary] = (),
+):
     """Обработка нажатия кнопки Меню."""
-    await cmd_menu(message, state)
+    await cmd_menu(message, state, db_user, active_goals)
 
 
 # ============== Обработка inline-кнопок меню ==============
@@ -126,10 +141,11 @@ async def handle_menu_button(message: types.Message, state: FSMContext):
 
 
 @router.callback_query(MenuCallback.filter(F.action == "new_goal"))
-async def handle_menu_new_goal(callback: types.CallbackQuery, state: FSMContext):
+async def handle_menu_new_goal(
+    callback: types.CallbackQuery, state: FSMContext, db_user: Optional[User] = None
+):
     """Переход к созданию новой цели."""
-    user = await User.get_or_none(telegram_id=callback.from_user.id)
-    if not user:
+    if not db_user:
         await callback.answer(
             "Сначала нужно познакомиться! Нажми /start", show_alert=True
         )
@@ -147,10 +163,14 @@ async def handle_menu_new_goal(callback: types.CallbackQuery, state: FSMContext)
 
 
 @router.callback_query(MenuCallback.filter(F.action == "checkin"))
-async def handle_menu_checkin(callback: types.CallbackQuery, state: FSMContext):
+async def handle_menu_checkin(
+    callback: types.CallbackQuery,
+    state: FSMContext,
+    db_user: Optional[User] = None,
+    active_goals: Sequence[GoalSummary] = (),
+):
     """Переход к чек-ину."""
-    user = await User.get_or_none(telegram_id=callback.from_user.id)
-    if not user:
+    if not db_user:
         await callback.answer(
             "Сначала нужно познакомиться! Нажми /start", show_alert=True
         )
@@ -159,8 +179,7 @@ async def handle_menu_checkin(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.edit_reply_markup(reply_markup=None)
     await callback.answer()
 
-    # Получаем цели пользователя
-    goals = await Goal.filter(user=user, status="active").all()
+    goals = active_goals
 
     if not goals:
         await callback.message.answer(
@@ -180,10 +199,11 @@ async def handle_menu_checkin(callback: types.CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(MenuCallback.filter(F.action == "reflect"))
-async def handle_menu_reflect(callback: types.CallbackQuery, state: FSMContext):
+async def handle_menu_reflect(
+    callback: types.CallbackQuery, state: FSMContext, db_user: Optional[User] = None
+):
     """Переход к рефлексии."""
-    user = await User.get_or_none(telegram_id=callback.from_user.id)
-    if not user:
+    if not db_user:
         await callback.answer(
             "Сначала нужно познакомиться! Нажми /start", show_alert=True
         )
@@ -214,12 +234,14 @@ async def handle_menu_reflect(callback: types.CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(MenuCallback.filter(F.action == "crisis"))
-async def handle_menu_crisis(callback: types.CallbackQuery, state: FSMContext):
+async def handle_menu_crisis(
+    callback: types.CallbackQuery, state: FSMContext, db_user: Optional[User] = None
+):
     """Переход в режим кризиса."""
     from datetime import datetime
     from src.bot.handlers.crisis import get_crisis_menu_keyboard, send_gif_if_available
 
-    user = await User.get_or_none(telegram_id=callback.from_user.id)
+    user = db_user
     if not user:
         await callback.answer(
             "Сначала нужно познакомиться! Нажми /start", show_alert=True
@@ -233,6 +255,7 @@ async def handle_menu_crisis(callback: types.CallbackQuery, state: FSMContext):
     user.current_mode = "crisis"
     user.mode_updated_at = datetime.now()
     await user.save()
+    invalidate_user_context(user.telegram_id)
 
     # Отправляем GIF поддержки (если есть)
     await send_gif_if_available(callback.message, "support")
@@ -246,10 +269,15 @@ async def handle_menu_crisis(callback: types.CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(MenuCallback.filter(F.action == "back"))
-async def handle_back_to_menu(callback: types.CallbackQuery, state: FSMContext):
+async def handle_back_to_menu(
+    callback: types.CallbackQuery,
+    state: FSMContext,
+    db_user: Optional[User] = None,
+    active_goals: Sequence[GoalSummary] = (),
+):
     """Возврат в главное меню."""
-    # AICODE-NOTE: Используем callback.from_user.id, не callback.message.from_user.id
-    user = await User.get_or_none(telegram_id=callback.from_user.id)
+    # AICODE-NOTE: db_user ищется по callback.from_user.id (см. UserContextMiddleware)
+    user = db_user
 
     if not user:
         await callback.answer(
@@ -260,8 +288,7 @@ async def handle_back_to_menu(callback: types.CallbackQuery, state: FSMContext):
     # Clear state
     await state.clear()
 
-    # Check if user has active goals
-    has_goals = await Goal.filter(user=user, status="active").exists()
+    has_goals = bool(active_goals)
 
     display_name = user.first_name or callback.from_user.first_name or "друг"
 
@@ -0,0 +1,323 @@
+"""
+Middleware бота.
+
+AICODE-NOTE: WhitelistMiddleware пропускает только ID из access_control
+(src/services/access_control.py) — список можно менять без рестарта.
+Он стоит первым на dp.update, так что апдейты незнакомцев не тратят
+лимиты, блокировки и записи дедупликации.
+
+AICODE-NOTE: UserContextMiddleware один раз на апдейт достаёт пользователя
+и его активные цели и кладёт их в data хендлера как `db_user`
+и `active_goals`. Результат кешируется по telegram_id на
+USER_CONTEXT_CACHE_TTL секунд, так что повторные нажатия кнопок не ходят
+в БД. Любой код, который меняет User или создаёт/меняет Goal, обязан
+вызвать invalidate_user_context(telegram_id) после записи.
+Кеш живёт в памяти процесса и сбрасывается только в нём. Это корректно,
+потому что все апдейты пользователя обрабатывает один процесс: единственный
+при WORKERS=1 или его шард (telegram_id % WORKERS, src/bot/sharding.py).
+Несколько независимых процессов за балансировщиком так не работают — запись
+из другого процесса (или скрипта) станет видна только через
+USER_CONTEXT_CACHE_TTL, поэтому TTL короткий.
+
+AICODE-NOTE: UpdateSerializationMiddleware (на dp.update) выполняет апдейты
+одного пользователя по очереди и отбрасывает дубликаты: повторную доставку
+того же update_id и одинаковый контент за DUPLICATE_WINDOW секунд
+(двойная отправка отчёта, двойное нажатие кнопки). Иначе два параллельных
+process_report создают два CheckIn и дважды платят за запрос к OpenAI.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject, Update
+
+from src.config import config
+from src.database.models import User
+from src.database.queries import GoalSummary, get_active_goal_summaries
+from src.services.access_control import access_control
+from src.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class WhitelistMiddleware(BaseMiddleware):
+    """Middleware to restrict access to allowed users only."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user and not access_control.is_allowed(user.id):
+            target = event.event if isinstance(event, Update) else event
+            # Отказ отвечаем один раз за интервал, остальное — молча
+            # (на кнопку — пустым ответом, чтобы не крутились "часики")
+            if not access_control.should_notify(user.id):
+                if isinstance(target, CallbackQuery):
+                    await target.answer()
+                return
+            logger.warning(
+                f"Unauthorized access attempt from user {user.id} "
+                f"(@{user.username})"
+            )
+            if isinstance(target, Message):
+                await target.answer("🔒 Access denied. This bot is in closed Alpha.")
+            elif isinstance(target, CallbackQuery):
+                await target.answer("🔒 Access denied.", show_alert=True)
+            return
+
+        return await handler(event, data)
+
+
+@dataclass(frozen=True)
+class UserContext:
+    user: Optional[User]
+    active_goals: Tuple[GoalSummary, ...]
+
+
+user_context_cache: TTLCache[UserContext] = TTLCache(
+    maxsize=config.USER_CONTEXT_CACHE_SIZE, ttl=config.USER_CONTEXT_CACHE_TTL
+)
+
+
+def invalidate_user_context(telegram_id: int) -> None:
+    """Сбрасывает кеш после записи в User/Goal этого пользователя."""
+    user_context_cache.pop(telegram_id)
+
+
+async def load_user_context(telegram_id: int) -> UserContext:
+    """Пользователь и его активные цели — из кеша или из БД."""
+    context = user_context_cache.get(telegram_id)
+    if context is not None:
+        return context
+
+    user = await User.get_or_none(telegram_id=telegram_id)
+    goals = tuple(await get_active_goal_summaries(user.id)) if user else ()
+    context = UserContext(user=user, active_goals=goals)
+    # Отсутствие пользователя тоже кешируется — /start его инвалидирует
+    user_context_cache.set(telegram_id, context)
+    return context
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Инжектирует db_user и active_goals в data хендлера."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        from_user = data.get("event_from_user")
+        if from_user:
+            context = await load_user_context(from_user.id)
+            data["db_user"] = context.user
+            data["active_goals"] = context.active_goals
+        return await handler(event, data)
+
+
+# Вложения, у которых есть file_unique_id
+_MEDIA_ATTRS = (
+    "animation",
+    "audio",
+    "document",
+    "sticker",
+    "video",
+    "video_note",
+    "voice",
+)
+
+BUSY_TEXT = "⏳ Я ещё отвечаю на предыдущее сообщение. Подожди немного и повтори."
+
+
+def _message_media(message: Message) -> Any:
+    if message.photo:
+        return message.photo[-1].file_unique_id
+    for attr in _MEDIA_ATTRS:
+        media = getattr(message, attr)
+        if media is not None:
+            return media.file_unique_id
+    if message.location:
+        return (message.location.latitude, message.location.longitude)
+    if message.contact:
+        return message.contact.phone_number
+    return None
+
+
+def content_key(update: Update) -> Optional[str]:
+    """Хеш содержимого апдейта: кто, куда и что отправил."""
+    if update.message:
+        message = update.message
+        parts = (
+            "message",
+            message.from_user.id if message.from_user else None,
+            message.chat.id,
+            message.content_type,
+            message.text or message.caption,
+            _message_media(message),
+        )
+    elif update.callback_query:
+        callback = update.callback_query
+        parts = (
+            "callback",
+            callback.from_user.id,
+            callback.message.message_id if callback.message else None,
+            callback.data,
+        )
+    else:
+        return None
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+
+class UpdateSerializationMiddleware(BaseMiddleware):
+    """
+    Очередь апдейтов пользователя с ограниченной длиной и подавление дубликатов.
+
+    AICODE-NOTE: Ждущий апдейт занимает слот tasks_concurrency_limit
+    (или webhook), поэтому у пользователя не больше max_waiting ждущих
+    апдейтов — остальные сразу получают короткий ответ "подожди", иначе
+    один флудер во время долгого запроса к AI занял бы все слоты.
+    update_id и хеш контента запоминаются только после успешной обработки;
+    пока апдейт в работе, его копии тоже считаются дубликатами.
+    """
+
+    def __init__(
+        self,
+        lock_timeout: float,
+        duplicate_window: float,
+        cache_size: int,
+        max_waiting: int,
+    ):
+        self.lock_timeout = lock_timeout
+        self.max_waiting = max_waiting
+        self._seen_updates: TTLCache[bool] = TTLCache(
+            maxsize=cache_size, ttl=duplicate_window
+        )
+        self._seen_content: TTLCache[bool] = TTLCache(
+            maxsize=cache_size, ttl=duplicate_window
+        )
+        # Апдейты и контент, которые сейчас обрабатываются или ждут очереди
+        self._in_flight_updates: Set[int] = set()
+        self._in_flight_content: Set[str] = set()
+        # telegram_id -> (lock, число держателей и ждущих)
+        self._locks: Dict[int, Tuple[asyncio.Lock, int]] = {}
+        self.duplicate_updates = 0
+        self.duplicate_content = 0
+        self.lock_timeouts = 0
+        self.rejected_busy = 0
+        self.max_wait = 0.0
+
+    def _is_duplicate(self, update: Update, key: Optional[str]) -> bool:
+        update_id = update.update_id
+        if update_id in self._in_flight_updates or self._seen_updates.get(update_id):
+            self.duplicate_updates += 1
+            return True
+        if key is not None and (
+            key in self._in_flight_content or self._seen_content.get(key)
+        ):
+            self.duplicate_content += 1
+            return True
+        return False
+
+    async def _notify(self, update: Update, text: Optional[str]) -> None:
+        """Короткий ответ на отброшенный апдейт; кнопку отвечаем всегда."""
+        try:
+            if update.callback_query:
+                # Убираем "часики" на кнопке, иначе клиент повторит нажатие
+                await update.callback_query.answer(text)
+            elif update.message and text:
+                await update.message.answer(text)
+        except Exception as e:
+            logger.warning(f"Failed to notify about dropped update: {e}")
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+
+        key = content_key(event)
+        if self._is_duplicate(event, key):
+            logger.info(f"Duplicate update {event.update_id} suppressed")
+            await self._notify(event, None)
+            return None
+
+        from_user = data.get("event_from_user")
+        if not from_user:
+            return await handler(event, data)
+
+        user_id = from_user.id
+        lock, users = self._locks.get(user_id, (asyncio.Lock(), 0))
+        if users > self.max_waiting:
+            # Один апдейт в работе и max_waiting в очереди — больше не ждём
+            self.rejected_busy += 1
+            logger.info(f"Update {event.update_id} rejected: user {user_id} busy")
+            await self._notify(event, BUSY_TEXT)
+            return None
+
+        self._locks[user_id] = (lock, users + 1)
+        self._in_flight_updates.add(event.update_id)
+        if key is not None:
+            self._in_flight_content.add(key)
+        started = time.monotonic()
+        try:
+            try:
+                await asyncio.wait_for(lock.acquire(), self.lock_timeout)
+            except asyncio.TimeoutError:
+                self.lock_timeouts += 1
+                logger.warning(
+                    f"Update {event.update_id} dropped: user {user_id} busy "
+                    f"for {self.lock_timeout:.0f}s"
+                )
+                await self._notify(event, BUSY_TEXT)
+                return None
+
+            self.max_wait = max(self.max_wait, time.monotonic() - started)
+            try:
+                result = await handler(event, data)
+            finally:
+                lock.release()
+
+            # Только успешно обработанный апдейт блокирует свои повторы
+            self._seen_updates.set(event.update_id, True)
+            if key is not None:
+                self._seen_content.set(key, True)
+            return result
+        finally:
+            self._in_flight_updates.discard(event.update_id)
+            if key is not None:
+                self._in_flight_content.discard(key)
+            lock, users = self._locks[user_id]
+            if users > 1:
+                self._locks[user_id] = (lock, users - 1)
+            else:
+                del self._locks[user_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active_users": len(self._locks),
+            "duplicate_updates": self.duplicate_updates,
+            "duplicate_content": self.duplicate_content,
+            "lock_timeouts": self.lock_timeouts,
+            "rejected_busy": self.rejected_busy,
+            "max_wait": round(self.max_wait, 3),
+        }
+
+
+# Singleton instance
+update_serializer = UpdateSerializationMiddleware(
+    lock_timeout=config.USER_LOCK_TIMEOUT,
+    duplicate_window=config.DUPLICATE_WINDOW,
+    cache_size=config.DEDUP_CACHE_SIZE,
+    max_waiting=config.USER_MAX_WAITING,
+)
@@ -0,0 +1,361 @@
+"""
+Шардирование обработки апдейтов по нескольким процессам-воркерам.
+
+AICODE-NOTE: Supervisor (WORKERS > 1) сам получает апдейты (polling или
+webhook) и раскладывает их по воркерам по telegram_id % WORKERS — апдейты
+одного пользователя всегда попадают в один процесс и обрабатываются там
+строго по очереди. Каждый воркер — отдельный процесс со своим event loop,
+Dispatcher и соединением с БД, поэтому Tortoise/JSON/base64 не делят одно ядро.
+FSM storage должен быть общим (sqlite/redis), memory не подходит.
+
+AICODE-NOTE: Очереди воркеров ограничены SHARD_QUEUE_SIZE, а воркер берёт
+из очереди новый апдейт, только пока у него меньше SHARD_QUEUE_SIZE
+необработанных. Если шард не успевает, webhook отвечает Telegram 503
+(он повторит доставку), а polling не сдвигает offset и ждёт. SIGTERM/SIGINT
+получает только supervisor: он перестаёт принимать апдейты и отправляет
+воркерам sentinel, те дообрабатывают очередь и выходят.
+Метрики AI (ai_service.metrics()) живут в процессах воркеров: раз в
+HEALTH_CHECK_INTERVAL воркер отправляет их supervisor'у через stats-очередь,
+и /health supervisor'а показывает последнюю сводку каждого шарда.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import queue as queue_module
+import secrets
+import signal
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot
+from aiohttp import web
+
+from src.config import config
+from src.bot.webhook import get_webhook_secret
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать корректного завершения воркера перед terminate()
+WORKER_STOP_TIMEOUT = 30.0
+HEALTH_CHECK_INTERVAL = 5.0
+
+
+def extract_user_id(update: Dict[str, Any]) -> int:
+    """
+    Достаёт telegram_id автора из сырого апдейта.
+    Для апдейтов без пользователя используется id чата (или 0).
+    """
+    for key, payload in update.items():
+        if key == "update_id" or not isinstance(payload, dict):
+            continue
+        for user_key in ("from", "user"):
+            user = payload.get(user_key)
+            if isinstance(user, dict) and "id" in user:
+                return user["id"]
+        chat = payload.get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return 0
+
+
+# ============== Воркер ==============
+
+
+def _forget_tail(tails: Dict[int, asyncio.Task], user_id: int):
+    """Убирает задачу из tails, если за ней не встала следующая."""
+
+    def callback(task: asyncio.Task) -> None:
+        if tails.get(user_id) is task:
+            del tails[user_id]
+
+    return callback
+
+
+def _worker_main(
+    index: int, queue: multiprocessing.Queue, stats: multiprocessing.Queue
+) -> None:
+    """Точка входа процесса-воркера."""
+    # Остановкой управляет supervisor через sentinel в очереди (Ctrl+C и
+    # SIGTERM от systemd/docker приходят всей группе процессов)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_run_worker(index, queue, stats))
+
+
+async def _report_metrics(index: int, stats: multiprocessing.Queue) -> None:
+    """Периодически отправляет метрики воркера supervisor'у."""
+    from src.services.ai import ai_service
+
+    while True:
+        try:
+            stats.put_nowait((index, {"ai": ai_service.metrics()}))
+        except queue_module.Full:
+            # Supervisor не успевает читать — пропускаем сводку
+            pass
+        await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+
+
+async def _run_worker(
+    index: int, queue: multiprocessing.Queue, stats: multiprocessing.Queue
+) -> None:
+    # Ленивый импорт: src.main импортирует этот модуль
+    from tortoise import Tortoise
+
+    from src.main import create_dispatcher, init_db
+
+    bot = Bot(token=config.BOT_TOKEN.get_secret_value())
+    dp = create_dispatcher()
+    # Схему уже создал supervisor
+    await init_db(generate_schemas=False)
+    await dp.emit_startup(bot=bot)
+    logger.info(f"Shard {index} started")
+    reporter = asyncio.create_task(_report_metrics(index, stats))
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(config.MAX_CONCURRENT_UPDATES)
+    # Сколько апдейтов воркер держит в памяти; остальные ждут в очереди шарда
+    backlog = asyncio.Semaphore(config.SHARD_QUEUE_SIZE)
+    # Последняя задача каждого пользователя — следующая ждёт её завершения
+    tails: Dict[int, asyncio.Task] = {}
+
+    async def process(previous: Optional[asyncio.Task], update: Dict[str, Any]):
+        try:
+            if previous:
+                await asyncio.gather(previous, return_exceptions=True)
+            async with semaphore:
+                await dp.feed_raw_update(bot, update)
+        except Exception as e:
+            logger.error(f"Shard {index} failed to process update: {e}")
+        finally:
+            backlog.release()
+
+    try:
+        while True:
+            await backlog.acquire()
+            update = await loop.run_in_executor(None, queue.get)
+            if update is None:
+                break
+
+            user_id = extract_user_id(update)
+            task = asyncio.create_task(process(tails.get(user_id), update))
+            tails[user_id] = task
+            task.add_done_callback(_forget_tail(tails, user_id))
+    finally:
+        reporter.cancel()
+        if tails:
+            await asyncio.gather(*tails.values(), return_exceptions=True)
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+        await Tortoise.close_connections()
+        logger.info(f"Shard {index} stopped")
+
+
+# ============== Supervisor ==============
+
+
+class ShardSupervisor:
+    """Запускает, мониторит и останавливает процессы-воркеры."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._ctx = multiprocessing.get_context("spawn")
+        self.queues: List[multiprocessing.Queue] = [
+            self._ctx.Queue(maxsize=config.SHARD_QUEUE_SIZE) for _ in range(workers)
+        ]
+        # (index, метрики) от воркеров; последняя сводка — в shard_metrics
+        self.stats_queue: multiprocessing.Queue = self._ctx.Queue(maxsize=workers * 4)
+        self.shard_metrics: List[Optional[Dict[str, Any]]] = [None] * workers
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        self.restarts = [0] * workers
+        self.dispatched = [0] * workers
+        self.rejected = [0] * workers
+
+    def shard_for(self, user_id: int) -> int:
+        return user_id % self.workers
+
+    def _spawn(self, index: int) -> None:
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(index, self.queues[index], self.stats_queue),
+            name=f"bot-shard-{index}",
+            daemon=False,
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self) -> None:
+        for index in range(self.workers):
+            self._spawn(index)
+        logger.info(f"Started {self.workers} shards")
+
+    def dispatch(self, update: Dict[str, Any]) -> bool:
+        """Ставит апдейт в очередь шарда; False — очередь переполнена."""
+        index = self.shard_for(extract_user_id(update))
+        try:
+            self.queues[index].put_nowait(update)
+        except queue_module.Full:
+            self.rejected[index] += 1
+            return False
+        self.dispatched[index] += 1
+        return True
+
+    def health(self) -> Dict[str, Any]:
+        shards = []
+        for index, process in enumerate(self.processes):
+            shards.append(
+                {
+                    "shard": index,
+                    "pid": process.pid if process else None,
+                    "alive": bool(process and process.is_alive()),
+                    "restarts": self.restarts[index],
+                    "dispatched": self.dispatched[index],
+                    "rejected": self.rejected[index],
+                    **(self.shard_metrics[index] or {}),
+                }
+            )
+        healthy = all(shard["alive"] for shard in shards)
+        return {"status": "ok" if healthy else "degraded", "shards": shards}
+
+    def collect_metrics(self) -> None:
+        """Забирает накопленные сводки воркеров из stats-очереди."""
+        while True:
+            try:
+                index, metrics = self.stats_queue.get_nowait()
+            except queue_module.Empty:
+                return
+            self.shard_metrics[index] = metrics
+
+    async def monitor(self) -> None:
+        """Перезапускает упавшие воркеры — очередь шарда при этом сохраняется."""
+        while True:
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+            self.collect_metrics()
+            for index, process in enumerate(self.processes):
+                if process and not process.is_alive():
+                    logger.error(
+                        f"Shard {index} died with code {process.exitcode}, restarting"
+                    )
+                    self.restarts[index] += 1
+                    self._spawn(index)
+
+    async def stop(self) -> None:
+        """Просит воркеры дообработать очередь и дожидается их завершения."""
+        loop = asyncio.get_running_loop()
+        for index, queue in enumerate(self.queues):
+            # Полная очередь освободится, когда воркер заберёт апдейты
+            try:
+                await loop.run_in_executor(
+                    None, queue.put, None, True, WORKER_STOP_TIMEOUT
+                )
+            except queue_module.Full:
+                logger.warning(f"Shard {index} queue is stuck, it will be killed")
+
+        for index, process in enumerate(self.processes):
+            if not process:
+                continue
+            await loop.run_in_executor(None, process.join, WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                logger.warning(f"Shard {index} did not stop in time, killing")
+                # SIGTERM воркеры игнорируют
+                process.kill()
+        logger.info("All shards stopped")
+
+
+async def _poll_updates(bot: Bot, supervisor: ShardSupervisor) -> None:
+    # getUpdates не работает, пока установлен webhook
+    await bot.delete_webhook()
+    offset: Optional[int] = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30)
+        except Exception as e:
+            logger.warning(f"getUpdates failed: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            raw = update.model_dump(mode="json", exclude_none=True, by_alias=True)
+            if not supervisor.dispatch(raw):
+                # Шард перегружен: offset не сдвигаем, Telegram отдаст апдейт снова
+                logger.warning(f"Shard queue full, update {update.update_id} delayed")
+                await asyncio.sleep(1)
+                break
+            offset = update.update_id + 1
+
+
+def _create_supervisor_app(supervisor: ShardSupervisor) -> web.Application:
+    app = web.Application()
+
+    async def health(request: web.Request) -> web.Response:
+        report = supervisor.health()
+        status = 200 if report["status"] == "ok" else 503
+        return web.json_response(report, status=status)
+
+    async def handle_update(request: web.Request) -> web.Response:
+        secret = get_webhook_secret()
+        received = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if secret and not secrets.compare_digest(received, secret):
+            return web.Response(body="Unauthorized", status=401)
+        if not supervisor.dispatch(await request.json()):
+            # Telegram повторит доставку позже
+            return web.Response(body="Shard overloaded", status=503)
+        return web.json_response({})
+
+    app.router.add_get("/health", health)
+    if config.BOT_MODE == "webhook":
+        app.router.add_post(config.WEBHOOK_PATH, handle_update)
+    return app
+
+
+async def run_supervisor(bot: Bot) -> None:
+    """Точка входа в режиме WORKERS > 1."""
+    if config.FSM_STORAGE == "memory":
+        raise ValueError("WORKERS > 1 requires FSM_STORAGE=sqlite or redis")
+
+    supervisor = ShardSupervisor(config.WORKERS)
+    supervisor.start()
+
+    # /health (и webhook в режиме webhook) обслуживает supervisor
+    runner = web.AppRunner(_create_supervisor_app(supervisor))
+    await runner.setup()
+    await web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT).start()
+
+    # Отмена основной задачи по сигналу запускает supervisor.stop() в finally
+    loop = asyncio.get_running_loop()
+    main_task = asyncio.current_task()
+    stopping = False
+
+    def request_stop(signum: signal.Signals) -> None:
+        nonlocal stopping
+        if not stopping:
+            stopping = True
+            logger.info(f"Received {signum.name}, stopping shards")
+            main_task.cancel()
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, request_stop, signum)
+
+    monitor = asyncio.create_task(supervisor.monitor())
+    try:
+        if config.BOT_MODE == "webhook":
+            if not config.WEBHOOK_BASE_URL:
+                raise ValueError("WEBHOOK_BASE_URL is required when BOT_MODE=webhook")
+            await bot.set_webhook(
+                config.WEBHOOK_BASE_URL.rstrip("/") + config.WEBHOOK_PATH,
+                secret_token=get_webhook_secret(),
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+            )
+            logger.info(f"Supervisor receiving webhook for {config.WORKERS} shards")
+            await asyncio.Event().wait()
+        else:
+            logger.info(f"Supervisor polling updates for {config.WORKERS} shards")
+            await _poll_updates(bot, supervisor)
+    except asyncio.CancelledError:
+        if not stopping:
+            raise
+    finally:
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(signum)
+        monitor.cancel()
+        await supervisor.stop()
+        await runner.cleanup()
+        await bot.session.close()
@@ -0,0 +1,417 @@
+"""
+Хранилища FSM для aiogram.
+
+AICODE-NOTE: MemoryStorage теряет незавершённые диалоги (/reflect, /checkin,
+/new_goal) при рестарте и не делится состоянием между процессами.
+BoundedMemoryStorage — вариант для dev с TTL и лимитом памяти.
+SQLiteStorage хранит состояние в отдельном файле в режиме WAL, Redis
+используется через штатный RedisStorage aiogram. Выбор — Settings.FSM_STORAGE.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import (
+    BaseStorage,
+    DefaultKeyBuilder,
+    KeyBuilder,
+    StateType,
+    StorageKey,
+)
+
+from src.config import config
+
+logger = logging.getLogger(__name__)
+
+# Время простоя (сек), после которого брошенный диалог удаляется.
+# Ключ — имя группы состояний (часть до ":" в строке состояния).
+STATE_IDLE_TTLS: Dict[str, int] = {
+    "OnboardingStates": 24 * 3600,
+    "GoalSettingStates": 3600,
+    "CheckInStates": 3600,
+    "ReflectStates": 2 * 3600,
+    "CrisisStates": 6 * 3600,
+}
+
+# Максимальная пауза (сек) между повторами неудачного сброса SQLiteStorage
+FLUSH_RETRY_MAX_DELAY = 30.0
+
+
+@dataclass
+class _Session:
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+    size: int = 0
+    last_access: float = field(default_factory=time.monotonic)
+
+
+class BoundedMemoryStorage(BaseStorage):
+    """
+    In-memory FSM-хранилище с TTL простоя и глобальным лимитом памяти.
+
+    AICODE-NOTE: Штатный MemoryStorage никогда не удаляет записи, поэтому
+    reflect_answers и черновики целей брошенных диалогов копятся вечно.
+    Здесь каждая сессия истекает после STATE_IDLE_TTLS[группа] секунд без
+    обращений, а при превышении max_bytes (оценка по JSON-размеру данных)
+    вытесняются давно неиспользуемые сессии (LRU).
+    """
+
+    def __init__(
+        self,
+        default_ttl: Optional[int] = None,
+        state_ttls: Optional[Dict[str, int]] = None,
+        max_bytes: Optional[int] = None,
+        sweep_interval: float = 60.0,
+    ):
+        self.default_ttl = default_ttl
+        self.state_ttls = state_ttls if state_ttls is not None else STATE_IDLE_TTLS
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+
+        self._sessions: OrderedDict[StorageKey, _Session] = OrderedDict()
+        self._total_bytes = 0
+        self._last_sweep = time.monotonic()
+        self.stats = {"evicted_ttl": 0, "evicted_lru": 0}
+
+    def _ttl_for(self, session: _Session) -> Optional[int]:
+        if session.state:
+            group = session.state.split(":", 1)[0]
+            if group in self.state_ttls:
+                return self.state_ttls[group]
+        return self.default_ttl
+
+    def _is_expired(self, session: _Session, now: float) -> bool:
+        ttl = self._ttl_for(session)
+        return ttl is not None and now - session.last_access > ttl
+
+    def _drop(self, key: StorageKey) -> None:
+        session = self._sessions.pop(key, None)
+        if session:
+            self._total_bytes -= session.size
+
+    def _sweep(self, now: float) -> None:
+        """Удаляет истёкшие сессии (полный проход раз в sweep_interval)."""
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+
+        expired = [k for k, s in self._sessions.items() if self._is_expired(s, now)]
+        for key in expired:
+            self._drop(key)
+        if expired:
+            self.stats["evicted_ttl"] += len(expired)
+            logger.info(f"Evicted {len(expired)} idle FSM sessions")
+
+    def _enforce_limit(self, keep: StorageKey) -> None:
+        if self.max_bytes is None:
+            return
+        evicted = 0
+        while self._total_bytes > self.max_bytes and len(self._sessions) > 1:
+            oldest = next(iter(self._sessions))
+            if oldest == keep:
+                self._sessions.move_to_end(keep)
+                continue
+            self._drop(oldest)
+            evicted += 1
+        if evicted:
+            self.stats["evicted_lru"] += evicted
+            logger.warning(f"FSM memory limit reached, evicted {evicted} sessions")
+
+    def _get(self, key: StorageKey) -> Optional[_Session]:
+        now = time.monotonic()
+        self._sweep(now)
+
+        session = self._sessions.get(key)
+        if session is None:
+            return None
+        if self._is_expired(session, now):
+            self._drop(key)
+            self.stats["evicted_ttl"] += 1
+            return None
+
+        session.last_access = now
+        self._sessions.move_to_end(key)
+        return session
+
+    def _put(
+        self, key: StorageKey, state: Optional[str], data: Dict[str, Any]
+    ) -> None:
+        self._drop(key)
+        if state is None and not data:
+            return
+
+        payload = json.dumps(data, ensure_ascii=False, default=str)
+        size = len(state or "") + len(payload)
+        self._sessions[key] = _Session(state=state, data=data, size=size)
+        self._total_bytes += size
+        self._enforce_limit(keep=key)
+
+    @property
+    def sessions_count(self) -> int:
+        return len(self._sessions)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        session = self._get(key)
+        if isinstance(state, State):
+            state = state.state
+        self._put(key, state, session.data if session else {})
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        session = self._get(key)
+        return session.state if session else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        session = self._get(key)
+        self._put(key, session.state if session else None, dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        session = self._get(key)
+        return dict(session.data) if session else {}
+
+    async def close(self) -> None:
+        logger.info(
+            f"FSM memory storage closed: {self.sessions_count} sessions, "
+            f"evicted {self.stats['evicted_ttl']} by TTL, "
+            f"{self.stats['evicted_lru']} by memory limit"
+        )
+        self._sessions.clear()
+        self._total_bytes = 0
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище в SQLite (WAL) с отложенной пакетной записью и TTL.
+
+    Записи сначала попадают в буфер _pending и сбрасываются в базу одной
+    транзакцией раз в flush_interval секунд (и при close()). Чтение сначала
+    смотрит в буфер, поэтому хендлер всегда видит свои последние изменения.
+    Пачка, которая сейчас пишется, лежит в _in_flight до commit: пока запись
+    не закончилась, чтение из базы вернуло бы старое состояние.
+    Состояния, не обновлявшиеся дольше ttl секунд, считаются брошенными
+    и удаляются.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: Optional[int] = None,
+        flush_interval: float = 0.5,
+        key_builder: Optional[KeyBuilder] = None,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True)
+
+        self._db: Optional[aiosqlite.Connection] = None
+        self._connect_lock = asyncio.Lock()
+        # key -> (state, data, updated_at)
+        self._pending: Dict[str, Tuple[Optional[str], Dict[str, Any], float]] = {}
+        # Пачка, которая сейчас пишется в базу
+        self._in_flight: Dict[str, Tuple[Optional[str], Dict[str, Any], float]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self._last_purge = 0.0
+
+    async def _connection(self) -> aiosqlite.Connection:
+        if self._db is None:
+            async with self._connect_lock:
+                if self._db is None:
+                    db = await aiosqlite.connect(self.path)
+                    await db.execute("PRAGMA journal_mode=WAL")
+                    await db.execute("PRAGMA synchronous=NORMAL")
+                    await db.execute(
+                        "CREATE TABLE IF NOT EXISTS fsm_states ("
+                        "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, "
+                        "updated_at REAL NOT NULL)"
+                    )
+                    await db.execute(
+                        "CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at "
+                        "ON fsm_states (updated_at)"
+                    )
+                    await db.commit()
+                    self._db = db
+        return self._db
+
+    def _is_expired(self, updated_at: float) -> bool:
+        return self.ttl is not None and time.time() - updated_at > self.ttl
+
+    async def _load(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        """Возвращает (state, data) с учётом несброшенного буфера и TTL."""
+        entry = self._pending.get(key) or self._in_flight.get(key)
+        if entry is not None:
+            state, data, _ = entry
+            return state, data
+
+        db = await self._connection()
+        async with db.execute(
+            "SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (key,)
+        ) as cursor:
+            row = await cursor.fetchone()
+
+        if row is None or self._is_expired(row[2]):
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def _schedule(
+        self, key: str, state: Optional[str], data: Dict[str, Any]
+    ) -> None:
+        self._pending[key] = (state, data, time.time())
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        # AICODE-NOTE: Неудачная пачка возвращается в _pending, и задача сама
+        # повторяет сброс с экспоненциальной паузой, иначе изменения лежали бы
+        # в памяти до следующего _schedule. Пока задача жива, новые записи
+        # копятся в том же буфере; всё, что пришло во время записи, сбрасывается
+        # следующим кругом.
+        delay = self.flush_interval
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self.flush()
+            except Exception as e:
+                delay = min(max(delay, 0.1) * 2, FLUSH_RETRY_MAX_DELAY)
+                logger.error(
+                    f"Failed to flush FSM states, retrying in {delay:.1f}s: {e}"
+                )
+                continue
+            if not self._pending:
+                return
+            delay = self.flush_interval
+
+    async def flush(self) -> None:
+        """Сбрасывает накопленные изменения в базу одной транзакцией."""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            self._in_flight, self._pending = self._pending, {}
+            try:
+                await self._write(self._in_flight)
+            except Exception:
+                # Изменения, сделанные во время записи, новее — их не трогаем
+                for key, entry in self._in_flight.items():
+                    self._pending.setdefault(key, entry)
+                raise
+            finally:
+                self._in_flight = {}
+
+        await self._purge_expired()
+
+    async def _write(
+        self, batch: Dict[str, Tuple[Optional[str], Dict[str, Any], float]]
+    ) -> None:
+        upserts = []
+        deletes = []
+        for key, (state, data, updated_at) in batch.items():
+            if state is None and not data:
+                deletes.append((key,))
+            else:
+                upserts.append(
+                    (key, state, json.dumps(data, ensure_ascii=False), updated_at)
+                )
+
+        db = await self._connection()
+        try:
+            if upserts:
+                await db.executemany(
+                    "INSERT INTO fsm_states (key, state, data, updated_at) "
+                    "VALUES (?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET "
+                    "state = excluded.state, data = excluded.data, "
+                    "updated_at = excluded.updated_at",
+                    upserts,
+                )
+            if deletes:
+                await db.executemany("DELETE FROM fsm_states WHERE key = ?", deletes)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        logger.debug(f"Flushed {len(upserts)} FSM states, deleted {len(deletes)}")
+
+    async def _purge_expired(self) -> None:
+        """Удаляет брошенные состояния (не чаще раза в ttl/10 секунд)."""
+        if self.ttl is None:
+            return
+        now = time.time()
+        if now - self._last_purge < self.ttl / 10:
+            return
+        self._last_purge = now
+
+        db = await self._connection()
+        cursor = await db.execute(
+            "DELETE FROM fsm_states WHERE updated_at < ?", (now - self.ttl,)
+        )
+        await db.commit()
+        if cursor.rowcount:
+            logger.info(f"Purged {cursor.rowcount} abandoned FSM states")
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.key_builder.build(key)
+        _, data = await self._load(storage_key)
+        if isinstance(state, State):
+            state = state.state
+        self._schedule(storage_key, state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        storage_key = self.key_builder.build(key)
+        state, _ = await self._load(storage_key)
+        self._schedule(storage_key, state, dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(self.key_builder.build(key))
+        return dict(data)
+
+    async def close(self) -> None:
+        if self._flusher and not self._flusher.done():
+            self._flusher.cancel()
+        await self.flush()
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+
+def create_storage() -> BaseStorage:
+    """Создаёт FSM-хранилище согласно Settings.FSM_STORAGE."""
+    backend = config.FSM_STORAGE
+
+    if backend == "sqlite":
+        logger.info(f"FSM storage: SQLite ({config.FSM_SQLITE_PATH})")
+        return SQLiteStorage(
+            config.FSM_SQLITE_PATH,
+            ttl=config.FSM_STATE_TTL,
+            flush_interval=config.FSM_FLUSH_INTERVAL,
+        )
+
+    if backend == "redis":
+        # Ленивый импорт: пакет redis нужен только для этого бэкенда
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        logger.info("FSM storage: Redis")
+        return RedisStorage.from_url(
+            config.FSM_REDIS_URL,
+            key_builder=DefaultKeyBuilder(with_bot_id=True),
+            state_ttl=config.FSM_STATE_TTL,
+            data_ttl=config.FSM_STATE_TTL,
+        )
+
+    logger.info("FSM storage: memory")
+    return BoundedMemoryStorage(
+        default_ttl=config.FSM_STATE_TTL, max_bytes=config.FSM_MAX_MEMORY_BYTES
+    )
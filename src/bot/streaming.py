@@ -0,0 +1,97 @@
+"""
+Прогрессивный вывод ответа AI через редактирование сообщения.
+
+AICODE-NOTE: Telegram ограничивает частоту правок (~1 в секунду на чат)
+и длину сообщения (4096 символов), поэтому правки идут не чаще
+STREAM_EDIT_INTERVAL, а текст при стриминге обрезается. Во время стриминга
+parse_mode не используется — незакрытая Markdown-разметка ломает правку.
+"""
+
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Callable, Optional
+
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from src.config import config
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+CURSOR = " ▍"
+
+
+class ThrottledMessageEditor:
+    """Редактирует одно сообщение не чаще заданного интервала."""
+
+    def __init__(self, message: types.Message, min_interval: Optional[float] = None):
+        self.message = message
+        self.min_interval = (
+            config.STREAM_EDIT_INTERVAL if min_interval is None else min_interval
+        )
+        self._last_text = message.text or ""
+        self._next_edit_at = 0.0
+
+    async def _edit(self, text: str, **kwargs) -> bool:
+        text = text[:TELEGRAM_MESSAGE_LIMIT]
+        try:
+            await self.message.edit_text(text, **kwargs)
+        except TelegramRetryAfter as e:
+            self._next_edit_at = time.monotonic() + e.retry_after
+            return False
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return True
+            logger.warning(f"Failed to edit streamed message: {e}")
+            return False
+        self._last_text = text
+        self._next_edit_at = time.monotonic() + self.min_interval
+        return True
+
+    async def update(self, text: str) -> None:
+        """Промежуточная правка — пропускается, если интервал ещё не прошёл."""
+        if text == self._last_text or time.monotonic() < self._next_edit_at:
+            return
+        await self._edit(text)
+
+    async def stream(
+        self,
+        chunks: AsyncIterator[str],
+        render: Callable[[str], str] = lambda text: text,
+    ) -> str:
+        """
+        Читает чанки и показывает накопленный текст.
+
+        Returns:
+            Полный текст ответа (без render)
+        """
+        text = ""
+        async for chunk in chunks:
+            text += chunk
+            await self.update(render(text) + CURSOR)
+        return text
+
+    async def finish(
+        self,
+        text: str,
+        parse_mode: Optional[str] = None,
+        reply_markup: Optional[types.InlineKeyboardMarkup] = None,
+    ) -> None:
+        """
+        Финальная правка (обязательная, без троттлинга).
+        Если разметка не прошла — повторяет без parse_mode,
+        если правка невозможна — отправляет новое сообщение.
+        """
+        delay = self._next_edit_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if await self._edit(text, parse_mode=parse_mode, reply_markup=reply_markup):
+            return
+        if parse_mode and await self._edit(text, reply_markup=reply_markup):
+            return
+        await self.message.answer(
+            text[:TELEGRAM_MESSAGE_LIMIT], reply_markup=reply_markup
+        )
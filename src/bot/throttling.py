@@ -0,0 +1,249 @@
+"""
+Flood control: token bucket на пользователя и класс хендлера.
+
+AICODE-NOTE: Один экземпляр регистрируется дважды. Как outer middleware
+на dp.update (до UpdateSerializationMiddleware) он списывает токен из
+дешёвого ведра "default" с каждого апдейта пользователя — флуд отсекается
+до очереди и слотов tasks_concurrency_limit. Как inner middleware на
+message/callback_query он проверяет класс хендлера из флага, например
+`@router.message(..., flags={"throttle": "ai"})` — так помечены хендлеры,
+которые вызывают OpenAI/vision. Для них ведро строже и есть общий лимит
+на всех пользователей. Флаги известны только после выбора хендлера,
+поэтому этот класс проверяется inner.
+
+Состояние ведер — в памяти процесса (MemoryThrottleBackend, с вытеснением)
+или в Redis (RedisThrottleBackend), чтобы лимит был общим для воркеров.
+"""
+
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject, Update
+
+from src.config import config
+from src.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+SLOW_DOWN_TEXT = "⏳ Слишком много запросов. Подожди немного и попробуй снова."
+
+
+@dataclass(frozen=True)
+class Limit:
+    per_minute: float
+    burst: int
+
+    @property
+    def rate(self) -> float:
+        return self.per_minute / 60.0
+
+    @property
+    def refill_time(self) -> float:
+        """За сколько секунд пустое ведро наполняется целиком."""
+        return self.burst / self.rate
+
+
+class MemoryThrottleBackend:
+    """
+    Ведра в памяти процесса. Ведро, которое простояло refill_time, снова
+    полное — такие записи истекают по TTL, остальные вытесняются по LRU.
+    """
+
+    def __init__(self, max_keys: int):
+        # key -> (токены, время обновления)
+        self._buckets: TTLCache[Tuple[float, float]] = TTLCache(
+            maxsize=max_keys, ttl=None
+        )
+
+    async def hit(self, key: str, limit: Limit) -> bool:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key) or (float(limit.burst), now)
+        tokens = min(limit.burst, tokens + (now - updated_at) * limit.rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets.set(key, (tokens, now), ttl=limit.refill_time)
+        return allowed
+
+    async def refund(self, key: str, limit: Limit) -> None:
+        state = self._buckets.get(key)
+        if state is not None:
+            tokens, updated_at = state
+            self._buckets.set(
+                key, (min(limit.burst, tokens + 1), updated_at), ttl=limit.refill_time
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", "keys": len(self._buckets)}
+
+
+# Тот же алгоритм атомарно на стороне Redis
+_REDIS_BUCKET_SCRIPT = """
+local burst = tonumber(ARGV[2])
+local rate = tonumber(ARGV[1])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 't', 'ts')
+local tokens = tonumber(state[1]) or burst
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(now - updated_at, 0) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 't', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[4]))
+return allowed
+"""
+
+_REDIS_REFUND_SCRIPT = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 't'))
+if tokens then
+    redis.call('HSET', KEYS[1], 't', math.min(tonumber(ARGV[1]), tokens + 1))
+end
+return 0
+"""
+
+
+class RedisThrottleBackend:
+    """Общие для всех воркеров ведра в Redis (нужен пакет redis)."""
+
+    def __init__(self, url: str, prefix: str = "throttle"):
+        # Ленивый импорт: пакет redis нужен только для этого бэкенда
+        try:
+            from redis.asyncio import Redis
+        except ImportError as e:
+            raise RuntimeError(
+                "THROTTLE_BACKEND=redis requires the redis package "
+                "(see requirements.txt)"
+            ) from e
+
+        self._redis = Redis.from_url(url)
+        self._script = self._redis.register_script(_REDIS_BUCKET_SCRIPT)
+        self._refund_script = self._redis.register_script(_REDIS_REFUND_SCRIPT)
+        self._prefix = prefix
+
+    async def hit(self, key: str, limit: Limit) -> bool:
+        allowed = await self._script(
+            keys=[f"{self._prefix}:{key}"],
+            args=[limit.rate, limit.burst, time.time(), math.ceil(limit.refill_time)],
+        )
+        return bool(allowed)
+
+    async def refund(self, key: str, limit: Limit) -> None:
+        await self._refund_script(keys=[f"{self._prefix}:{key}"], args=[limit.burst])
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "redis"}
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(
+        self,
+        backend: Any,
+        limits: Dict[str, Limit],
+        global_limits: Dict[str, Limit],
+        notify_interval: float,
+    ):
+        self.backend = backend
+        self.limits = limits
+        self.global_limits = global_limits
+        # Кому уже ответили "слишком много запросов" — повторно молчим
+        self._notified: TTLCache[bool] = TTLCache(maxsize=10000, ttl=notify_interval)
+        self.throttled: Dict[str, int] = {name: 0 for name in limits}
+        self.throttled_global: Dict[str, int] = {name: 0 for name in global_limits}
+
+    async def _allowed(self, user_id: int, name: str) -> bool:
+        user_key = f"{name}:{user_id}"
+        if not await self.backend.hit(user_key, self.limits[name]):
+            self.throttled[name] += 1
+            return False
+        # Общий лимит проверяется после личного: флудер не тратит его за всех.
+        # Отказ по общему лимиту возвращает пользователю его токен
+        global_limit = self.global_limits.get(name)
+        if global_limit and not await self.backend.hit(f"{name}:*", global_limit):
+            self.throttled_global[name] += 1
+            await self.backend.refund(user_key, self.limits[name])
+            return False
+        return True
+
+    async def _slow_down(self, event: TelegramObject, user_id: int) -> None:
+        # Текст — не чаще раза в notify_interval, но кнопку отвечаем всегда,
+        # иначе у пользователя крутятся "часики"
+        text: Optional[str] = SLOW_DOWN_TEXT
+        if self._notified.get(user_id):
+            text = None
+        else:
+            self._notified.set(user_id, True)
+        try:
+            if isinstance(event, CallbackQuery):
+                await event.answer(text, show_alert=False)
+            elif isinstance(event, Message) and text:
+                await event.answer(text)
+        except Exception as e:
+            logger.warning(f"Failed to send throttle notice: {e}")
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        from_user = data.get("event_from_user")
+        if not from_user:
+            return await handler(event, data)
+
+        if isinstance(event, Update):
+            # Outer: общее ведро на все апдейты пользователя
+            name: Optional[str] = "default"
+            target = event.event
+        else:
+            # Inner: только классы из флага хендлера, "default" уже списан
+            name = get_flag(data, "throttle")
+            target = event
+            if name not in self.limits or name == "default":
+                return await handler(event, data)
+
+        if not await self._allowed(from_user.id, name):
+            logger.info(f"Throttled user {from_user.id} ({name})")
+            await self._slow_down(target, from_user.id)
+            return None
+        return await handler(event, data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.backend.stats(),
+            "throttled": self.throttled,
+            "throttled_global": self.throttled_global,
+        }
+
+
+def create_throttling_middleware() -> ThrottlingMiddleware:
+    if config.THROTTLE_BACKEND == "redis":
+        backend: Any = RedisThrottleBackend(config.THROTTLE_REDIS_URL)
+        logger.info("Throttling backend: Redis")
+    else:
+        backend = MemoryThrottleBackend(max_keys=config.THROTTLE_MAX_KEYS)
+
+    return ThrottlingMiddleware(
+        backend,
+        limits={
+            "default": Limit(config.THROTTLE_PER_MINUTE, config.THROTTLE_BURST),
+            "ai": Limit(config.THROTTLE_AI_PER_MINUTE, config.THROTTLE_AI_BURST),
+        },
+        global_limits={
+            "ai": Limit(
+                config.THROTTLE_AI_GLOBAL_PER_MINUTE, config.THROTTLE_AI_GLOBAL_BURST
+            ),
+        },
+        notify_interval=config.THROTTLE_NOTIFY_INTERVAL,
+    )
+
+
+# Singleton instance
+throttling = create_throttling_middleware()
@@ -0,0 +1,132 @@
+"""
+Режим доставки апдейтов через webhook (встроенный aiohttp-сервер).
+
+AICODE-NOTE: В режиме polling все апдейты идут через один цикл getUpdates.
+С webhook Telegram сам пушит апдейты на WEBHOOK_BASE_URL + WEBHOOK_PATH,
+их можно раскидывать балансировщиком. Запросы проверяются по заголовку
+X-Telegram-Bot-Api-Secret-Token, число одновременно обрабатываемых апдейтов
+ограничено MAX_CONCURRENT_UPDATES. GET /health — для балансировщика.
+
+Лимит — outer-middleware на dp.update, а не переопределение приватных
+методов SimpleRequestHandler: публичный API aiogram не меняется между
+минорными версиями. Middleware регистрируется последним, поэтому
+отброшенные whitelist/throttling/дедупликацией апдейты слот не занимают.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import TelegramObject
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from src.bot.breathing import breathing_scheduler
+from src.bot.middlewares import update_serializer
+from src.bot.throttling import throttling
+from src.config import config
+from src.logging_config import logging_stats
+from src.services.access_control import access_control
+from src.services.ai import ai_service
+from src.database.sqlite import sqlite_maintenance
+from src.services.loop_monitor import loop_monitor
+from src.services.vision import image_pipeline
+
+logger = logging.getLogger(__name__)
+
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """Ограничивает число одновременно обрабатываемых апдейтов."""
+
+    def __init__(self, max_concurrent_updates: int):
+        self._semaphore = asyncio.Semaphore(max_concurrent_updates)
+        # Апдейты, принятые от Telegram и ещё не обработанные (включая ждущих)
+        self.in_flight = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        self.in_flight += 1
+        try:
+            async with self._semaphore:
+                return await handler(event, data)
+        finally:
+            self.in_flight -= 1
+
+
+def get_webhook_secret() -> Optional[str]:
+    if config.WEBHOOK_SECRET:
+        return config.WEBHOOK_SECRET.get_secret_value()
+    return None
+
+
+def create_webhook_app(bot: Bot, dp: Dispatcher) -> web.Application:
+    """Собирает aiohttp-приложение с webhook- и health-эндпоинтами."""
+    app = web.Application()
+
+    limiter = ConcurrencyLimitMiddleware(config.MAX_CONCURRENT_UPDATES)
+    dp.update.outer_middleware(limiter)
+
+    handler = SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=get_webhook_secret(),
+    )
+    handler.register(app, path=config.WEBHOOK_PATH)
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "status": "ok",
+                "mode": "webhook",
+                "in_flight": limiter.in_flight,
+                "loop": loop_monitor.stats(),
+                "images": image_pipeline.stats(),
+                "sqlite": sqlite_maintenance.stats(),
+                "breathing": breathing_scheduler.stats(),
+                "updates": update_serializer.stats(),
+                "throttling": throttling.stats(),
+                "access": access_control.stats(),
+                "logging": logging_stats(),
+                "ai": ai_service.metrics(),
+            }
+        )
+
+    app.router.add_get("/health", health)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher) -> None:
+    """Регистрирует webhook в Telegram и обслуживает его до остановки."""
+    if not config.WEBHOOK_BASE_URL:
+        raise ValueError("WEBHOOK_BASE_URL is required when BOT_MODE=webhook")
+
+    app = create_webhook_app(bot, dp)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=config.WEBHOOK_HOST, port=config.WEBHOOK_PORT)
+    await site.start()
+
+    url = config.WEBHOOK_BASE_URL.rstrip("/") + config.WEBHOOK_PATH
+    await bot.set_webhook(
+        url,
+        secret_token=get_webhook_secret(),
+        max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    logger.info(
+        f"Webhook set to {url}, listening on "
+        f"{config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}"
+    )
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        # on_shutdown закрывает FSM storage и сессию бота
+        await runner.cleanup()
@@ -24,7 +24,8 @@ class Goal(models.Model):
     user = fields.ForeignKeyField("models.User", related_name="goals")
     title = fields.CharField(max_length=255)
     description = fields.TextField(null=True)
-    image_base64 = fields.TextField(null=True)
+    # AICODE-NOTE: Само изображение лежит в BlobStore, в строке только SHA-256
+    image_hash = fields.CharField(max_length=64, null=True)
     status = fields.CharField(max_length=50, default="active")
     created_at = fields.DatetimeField(auto_now_add=True)
 
@@ -39,8 +40,23 @@ class CheckIn(models.Model):
     goal = fields.ForeignKeyField("models.Goal", related_name="checkins")
     date = fields.DatetimeField(auto_now_add=True)
     report_text = fields.TextField()
-    image_base64 = fields.TextField(null=True)
+    image_hash = fields.CharField(max_length=64, null=True)
     ai_feedback = fields.TextField(null=True)
 
     class Meta:
         table = "checkins"
+
+
+class ImageBlob(models.Model):
+    """
+    Учёт изображений в content-addressed хранилище (src/services/blob_store.py).
+    Файл удаляется с диска, когда ref_count падает до нуля.
+    """
+
+    sha256 = fields.CharField(max_length=64, pk=True)
+    size = fields.IntField()
+    ref_count = fields.IntField(default=0)
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "image_blobs"
@@ -0,0 +1,59 @@
+"""
+Лёгкие запросы к целям для хендлеров.
+
+AICODE-NOTE: Меню и списки целей показывают только id и title, поэтому
+здесь используются проекции .values()/.only() вместо полных Goal.
+Тяжёлые поля (description, image_hash) подгружаются лениво через
+GoalSummary.load_details() — только когда они реально нужны (AI-анализ).
+"""
+
+from dataclasses import dataclass
+
+from src.database.models import Goal
+
+SUMMARY_FIELDS = ("id", "title")
+DETAIL_FIELDS = ("id", "title", "description", "image_hash")
+
+
+@dataclass(frozen=True)
+class GoalSummary:
+    """Минимальное представление цели для кнопок и текстов."""
+
+    id: int
+    title: str
+
+    async def load_details(self) -> Goal | None:
+        """Лениво загружает тяжёлые поля цели (description, image_hash)."""
+        return await Goal.filter(id=self.id).only(*DETAIL_FIELDS).first()
+
+
+async def get_active_goal_summaries(user_id: int) -> list[GoalSummary]:
+    """Активные цели пользователя (по User.id) — только id и title."""
+    rows = await Goal.filter(user_id=user_id, status="active").values(
+        *SUMMARY_FIELDS
+    )
+    return [GoalSummary(**row) for row in rows]
+
+
+async def get_first_active_goal_summary(user_id: int) -> GoalSummary | None:
+    """Первая активная цель пользователя (по User.id)."""
+    row = (
+        await Goal.filter(user_id=user_id, status="active")
+        .first()
+        .values(*SUMMARY_FIELDS)
+    )
+    return GoalSummary(**row) if row else None
+
+
+async def get_user_goal_summary(goal_id: int, telegram_id: int) -> GoalSummary | None:
+    """
+    Цель по id с проверкой владельца.
+
+    AICODE-NOTE: Фильтр по user__telegram_id защищает от IDOR.
+    """
+    row = (
+        await Goal.filter(id=goal_id, user__telegram_id=telegram_id)
+        .first()
+        .values(*SUMMARY_FIELDS)
+    )
+    return GoalSummary(**row) if row else None
@@ -0,0 +1,133 @@
+"""
+Профиль SQLite для продакшена и его обслуживание.
+
+AICODE-NOTE: Pragma применяются Tortoise при открытии соединения
+(см. build_connection в src/database/config.py), здесь — только список
+и проверка. WAL даёт читателям не блокировать писателя, а
+synchronous=NORMAL в WAL-режиме делает fsync только на checkpoint, а не
+на каждый CheckIn.create (при сбое питания теряются последние коммиты,
+но база остаётся целой). WAL-файл растёт между checkpoint, поэтому
+SQLiteMaintenance периодически делает wal_checkpoint(TRUNCATE)
+и PRAGMA optimize.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from tortoise import connections
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+from src.config import config
+
+logger = logging.getLogger(__name__)
+
+# Как SQLite возвращает значения, заданные строкой
+_SYNCHRONOUS_CODES = {"OFF": 0, "NORMAL": 1, "FULL": 2, "EXTRA": 3}
+_TEMP_STORE_CODES = {"DEFAULT": 0, "FILE": 1, "MEMORY": 2}
+
+
+def sqlite_pragmas() -> Dict[str, Any]:
+    """Pragma, которые задаются каждому соединению."""
+    return {
+        "journal_mode": "WAL",
+        "synchronous": config.SQLITE_SYNCHRONOUS,
+        "mmap_size": config.SQLITE_MMAP_SIZE,
+        "cache_size": config.SQLITE_CACHE_SIZE,
+        "busy_timeout": config.SQLITE_BUSY_TIMEOUT,
+        "temp_store": "MEMORY",
+    }
+
+
+def _expected(pragma: str, value: Any) -> Any:
+    if pragma == "journal_mode":
+        return str(value).lower()
+    if pragma == "synchronous":
+        return _SYNCHRONOUS_CODES[str(value).upper()]
+    if pragma == "temp_store":
+        return _TEMP_STORE_CODES[str(value).upper()]
+    return int(value)
+
+
+def is_sqlite(db: BaseDBAsyncClient) -> bool:
+    return db.capabilities.dialect == "sqlite"
+
+
+async def verify_pragmas(db: BaseDBAsyncClient) -> Dict[str, Any]:
+    """
+    Читает pragma с соединения и сравнивает с профилем.
+    Возвращает {pragma: фактическое значение} для несовпавших.
+    """
+    mismatched: Dict[str, Any] = {}
+    for pragma, value in sqlite_pragmas().items():
+        _, rows = await db.execute_query(f"PRAGMA {pragma}")
+        actual = rows[0][0] if rows else None
+        if actual != _expected(pragma, value):
+            mismatched[pragma] = actual
+
+    if mismatched:
+        # Например, mmap отключён при сборке SQLite или база в памяти
+        logger.warning(f"SQLite pragmas not applied: {mismatched}")
+    else:
+        logger.info(f"SQLite pragma profile applied: {sqlite_pragmas()}")
+    return mismatched
+
+
+class SQLiteMaintenance:
+    """Периодический wal_checkpoint(TRUNCATE) и PRAGMA optimize."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.runs = 0
+        self.last_duration = 0.0
+        self.last_checkpoint: Optional[Dict[str, int]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if not is_sqlite(connections.get("default")):
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def run_once(self) -> None:
+        db = connections.get("default")
+        started = time.monotonic()
+        _, rows = await db.execute_query("PRAGMA wal_checkpoint(TRUNCATE)")
+        await db.execute_query("PRAGMA optimize")
+        self.last_duration = time.monotonic() - started
+        self.runs += 1
+
+        busy, log_frames, checkpointed = rows[0] if rows else (0, 0, 0)
+        self.last_checkpoint = {
+            "busy": busy,
+            "log_frames": log_frames,
+            "checkpointed": checkpointed,
+        }
+        if busy:
+            # Checkpoint не дошёл до конца из-за активных читателей — повторим позже
+            logger.info(f"SQLite checkpoint incomplete: {self.last_checkpoint}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"SQLite maintenance failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "last_duration": round(self.last_duration, 3),
+            "last_checkpoint": self.last_checkpoint,
+        }
+
+
+# Singleton instance
+sqlite_maintenance = SQLiteMaintenance(interval=config.SQLITE_MAINTENANCE_INTERVAL)
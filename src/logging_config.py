@@ -0,0 +1,192 @@
+"""
+Неблокирующее логирование: QueueHandler -> поток QueueListener -> файл/stdout.
+
+AICODE-NOTE: Вызов logger.info() в event loop подставляет %-аргументы
+и текст исключения (дёшево, и аргументы не успеют измениться) и кладёт
+запись в ограниченную очередь. Оформление строки (JSON/текст) и запись
+на диск происходят в потоке QueueListener, так что медленный диск
+не тормозит обработку апдейтов. Если очередь переполнена, запись
+отбрасывается и учитывается в dropped — loop не ждёт никогда.
+Каждый процесс-воркер (WORKERS > 1) пишет в свой файл: bot.log -> bot.1.log,
+иначе несколько RotatingFileHandler портили бы один файл при ротации.
+Шумные INFO-логгеры (каждый апдейт, каждый запрос к AI) сэмплируются
+по LOG_SAMPLING; WARNING и выше проходят всегда.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import multiprocessing
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler,
+)
+from typing import Any, Dict, List, Optional
+
+from src.config import config
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Только для formatException в NonBlockingQueueHandler.prepare
+_EXCEPTION_FORMATTER = logging.Formatter()
+
+# Атрибуты LogRecord; всё остальное пришло через extra= и попадает в JSON
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, сообщение, extra."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает долю rate записей ниже WARNING от логгера (и его потомков)."""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self.sampled_out = 0
+
+    def _rate(self, name: str) -> float:
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        if random.random() < self._rate(record.name):
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Штатный prepare целиком форматирует запись в вызывающем потоке.
+        # Здесь только фиксируем сообщение и traceback — оформление
+        # остаётся потоку слушателя
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _EXCEPTION_FORMATTER.formatException(
+                    record.exc_info
+                )
+            # Traceback держит ссылки на кадры стека — в очередь не передаём
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DrainingQueueListener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # При остановке ждём места в очереди: записи перед выходом не теряем
+        self.queue.put(self._sentinel)
+
+
+def _log_path() -> str:
+    """Файл лога процесса: у воркера bot-shard-1 это bot.1.log."""
+    process = multiprocessing.current_process()
+    if process.name == "MainProcess":
+        return config.LOG_FILE
+    shard = process.name.rpartition("-")[2] or str(process.pid)
+    path = Path(config.LOG_FILE)
+    return str(path.with_name(f"{path.stem}.{shard}{path.suffix}"))
+
+
+def _file_handler() -> logging.Handler:
+    path = _log_path()
+    if config.LOG_ROTATE_WHEN:
+        return TimedRotatingFileHandler(
+            path,
+            when=config.LOG_ROTATE_WHEN,
+            backupCount=config.LOG_BACKUP_COUNT,
+            encoding="utf-8",
+        )
+    return RotatingFileHandler(
+        path,
+        maxBytes=config.LOG_MAX_BYTES,
+        backupCount=config.LOG_BACKUP_COUNT,
+        encoding="utf-8",
+    )
+
+
+_listener: Optional[DrainingQueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+_sampling: Optional[SamplingFilter] = None
+
+
+def setup_logging() -> None:
+    """Настраивает root-логгер; повторный вызов ничего не делает."""
+    global _listener, _queue_handler, _sampling
+    if _listener is not None:
+        return
+
+    formatter = logging.Formatter(TEXT_FORMAT)
+    if config.LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    handlers: List[logging.Handler] = [logging.StreamHandler(sys.stdout)]
+    if config.LOG_FILE:
+        handlers.append(_file_handler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.Queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+    _sampling = SamplingFilter(config.LOG_SAMPLING)
+    _queue_handler.addFilter(_sampling)
+
+    root = logging.getLogger()
+    root.setLevel(config.LOG_LEVEL)
+    root.handlers = [_queue_handler]
+
+    _listener = DrainingQueueListener(
+        log_queue, *handlers, respect_handler_level=True
+    )
+    _listener.start()
+    # Дописываем очередь при выходе из процесса
+    atexit.register(_listener.stop)
+
+
+def logging_stats() -> Dict[str, Any]:
+    return {
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+        "dropped": _queue_handler.dropped if _queue_handler else 0,
+        "sampled_out": _sampling.sampled_out if _sampling else 0,
+    }
@@ -1,58 +1,43 @@
 import asyncio
 import logging
-import sys
-from typing import Callable, Dict, Any, Awaitable
 
-from aiogram import Bot, Dispatcher, BaseMiddleware
-from aiogram.types import Message, TelegramObject, CallbackQuery, BotCommand, ErrorEvent
-from aiogram.fsm.storage.memory import MemoryStorage
-from tortoise import Tortoise
+from aiogram import Bot, Dispatcher
+from aiogram.types import BotCommand, ErrorEvent
+from tortoise import Tortoise, connections
 
 from src.config import config
+from src.logging_config import setup_logging
 from src.database.config import TORTOISE_ORM
+from src.database.sqlite import is_sqlite, sqlite_maintenance, verify_pragmas
+from src.bot.breathing import breathing_scheduler
+from src.bot.storage import create_storage
+from src.bot.throttling import throttling
+from src.bot.middlewares import (
+    UserContextMiddleware,
+    WhitelistMiddleware,
+    update_serializer,
+)
+from src.bot.webhook import run_webhook
+from src.bot.sharding import run_supervisor
+from src.services.access_control import access_control
+from src.services.loop_monitor import loop_monitor
+from src.services.vision import image_pipeline
 from src.bot.handlers import start, onboarding, goal_setting, checkin, crisis, reflect
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[logging.FileHandler("bot.log"), logging.StreamHandler(sys.stdout)],
-)
+# Configure logging: запись в файл/stdout — в фоновом потоке
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
-class WhitelistMiddleware(BaseMiddleware):
-    """Middleware to restrict access to allowed users only."""
-
-    async def __call__(
-        self,
-        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
-        event: TelegramObject,
-        data: Dict[str, Any],
-    ) -> Any:
-        user = data.get("event_from_user")
-        if user and config.ALLOWED_USER_IDS:
-            if user.id not in config.ALLOWED_USER_IDS:
-                logger.warning(
-                    f"Unauthorized access attempt from user {user.id} "
-                    f"(@{user.username})"
-                )
-                # We can silently ignore or send a message.
-                # For messages, we can reply.
-                if isinstance(event, Message):
-                    await event.answer("🔒 Access denied. This bot is in closed Alpha.")
-                elif isinstance(event, CallbackQuery):
-                    await event.answer("🔒 Access denied.", show_alert=True)
-                return
-
-        return await handler(event, data)
-
-
-async def init_db():
+async def init_db(generate_schemas: bool = True):
     """Initialize database connection."""
     await Tortoise.init(config=TORTOISE_ORM)
-    # Safe to run, but usually handled by Aerich
-    await Tortoise.generate_schemas(safe=True)
+    db = connections.get("default")
+    if is_sqlite(db):
+        await verify_pragmas(db)
+    if generate_schemas:
+        # Safe to run, but usually handled by Aerich
+        await Tortoise.generate_schemas(safe=True)
 
 
 async def set_bot_commands(bot: Bot):
@@ -70,17 +55,27 @@ async def set_bot_commands(bot: Bot):
     logger.info("Bot commands menu set up")
 
 
-async def main():
-    """Entry point for the bot."""
-    # Initialize Bot and Dispatcher
-    bot = Bot(token=config.BOT_TOKEN.get_secret_value())
-    dp = Dispatcher(storage=MemoryStorage())
+def create_dispatcher() -> Dispatcher:
+    """Собирает Dispatcher: storage, middleware, роутеры и обработчик ошибок."""
+    dp = Dispatcher(storage=create_storage())
 
     # Middleware setup
-    if config.ALLOWED_USER_IDS:
-        logger.info(f"Whitelist enabled: {config.ALLOWED_USER_IDS}")
-        dp.message.outer_middleware(WhitelistMiddleware())
-        dp.callback_query.outer_middleware(WhitelistMiddleware())
+    # Whitelist первым: незнакомцы не доходят до лимитов и очередей
+    if access_control.enabled:
+        logger.info("Whitelist enabled")
+        dp.update.outer_middleware(WhitelistMiddleware())
+    # Флуд отсекается до очереди пользователя (см. src/bot/throttling.py)
+    dp.update.outer_middleware(throttling)
+    # Апдейты одного пользователя — по очереди, дубликаты отбрасываются
+    dp.update.outer_middleware(update_serializer)
+
+    # Пользователь и активные цели — один раз на апдейт, с кешем
+    dp.message.outer_middleware(UserContextMiddleware())
+    dp.callback_query.outer_middleware(UserContextMiddleware())
+
+    # Flood control для классов из флагов хендлера ("ai") — только inner
+    dp.message.middleware(throttling)
+    dp.callback_query.middleware(throttling)
 
     # Include routers
     dp.include_router(start.router)
@@ -90,6 +85,29 @@ async def main():
     dp.include_router(crisis.router)
     dp.include_router(reflect.router)
 
+    # Lag event loop — проверка, что CPU-работа не блокирует обработку апдейтов;
+    # для SQLite — периодический checkpoint WAL; таймеры дыхательных упражнений
+    persist_breathing = config.BREATHING_STATE_PATH and config.WORKERS == 1
+
+    @dp.startup()
+    async def on_startup(bot: Bot):
+        loop_monitor.start()
+        sqlite_maintenance.start()
+        access_control.start()
+        if persist_breathing:
+            breathing_scheduler.load(config.BREATHING_STATE_PATH)
+        breathing_scheduler.start(bot)
+
+    @dp.shutdown()
+    async def on_shutdown():
+        loop_monitor.stop()
+        sqlite_maintenance.stop()
+        access_control.stop()
+        await breathing_scheduler.stop()
+        if persist_breathing:
+            breathing_scheduler.save(config.BREATHING_STATE_PATH)
+        image_pipeline.shutdown()
+
     # Global error handler
     @dp.error()
     async def global_error_handler(event: ErrorEvent):
@@ -123,15 +141,40 @@ async def main():
         # Возвращаем True чтобы aiogram не перебрасывал исключение дальше
         return True
 
-    # Database setup
-    await init_db()
+    return dp
+
+
+async def main():
+    """Entry point for the bot."""
+    bot = Bot(token=config.BOT_TOKEN.get_secret_value())
 
     # Setup bot commands menu
     await set_bot_commands(bot)
 
-    logger.info("Starting bot...")
+    if config.WORKERS > 1:
+        # Схему создаёт supervisor один раз до старта воркеров, иначе
+        # все воркеры одновременно выполняли бы CREATE TABLE на одной базе.
+        # Dispatcher и соединение с БД воркеры поднимают сами
+        await init_db()
+        await Tortoise.close_connections()
+        await run_supervisor(bot)
+        return
+
+    dp = create_dispatcher()
+
+    # Database setup
+    await init_db()
+
+    logger.info(f"Starting bot in {config.BOT_MODE} mode...")
     try:
-        await dp.start_polling(bot)
+        if config.BOT_MODE == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            # getUpdates не работает, пока установлен webhook
+            await bot.delete_webhook()
+            await dp.start_polling(
+                bot, tasks_concurrency_limit=config.MAX_CONCURRENT_UPDATES
+            )
     finally:
         await Tortoise.close_connections()
 
@@ -0,0 +1,130 @@
+"""
+Whitelist альфа-тестеров с перезагрузкой без рестарта.
+
+AICODE-NOTE: ID берутся из ALLOWED_USER_IDS (env) и из файла
+ALLOWED_USERS_FILE — по одному ID на строку, `#` — комментарий. Файл
+перечитывается фоновой задачей, когда меняется его mtime, и множество
+подменяется целиком, так что проверка на каждом апдейте — один lookup
+во frozenset. Если файл не читается, остаётся прежний список.
+Отказ незнакомцу отвечаем не чаще раза в ACCESS_DENIED_NOTIFY_INTERVAL
+(negative cache), иначе флуд от чужого аккаунта превращается в флуд
+ответами от нашего бота.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Dict, FrozenSet, Iterable, Optional
+
+from src.config import config
+from src.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+def parse_ids(lines: Iterable[str]) -> FrozenSet[int]:
+    ids = set()
+    for number, line in enumerate(lines, start=1):
+        value = line.split("#", 1)[0].strip()
+        if not value:
+            continue
+        try:
+            ids.add(int(value))
+        except ValueError:
+            logger.warning(f"Allowed users file: invalid ID on line {number}")
+    return frozenset(ids)
+
+
+class AccessControlStore:
+    def __init__(
+        self,
+        static_ids: Iterable[int],
+        path: Optional[str],
+        reload_interval: float,
+        notify_interval: float,
+    ):
+        self.static_ids = frozenset(static_ids)
+        self.path = path
+        self.reload_interval = reload_interval
+        self._ids: FrozenSet[int] = self.static_ids
+        self._mtime: Optional[float] = None
+        self._denied: TTLCache[bool] = TTLCache(maxsize=10000, ttl=notify_interval)
+        self._task: Optional[asyncio.Task] = None
+        self.lookups = 0
+        self.denials = 0
+        self.reloads = 0
+
+    @property
+    def enabled(self) -> bool:
+        """Whitelist включён, если задан хоть один источник."""
+        return bool(self.static_ids) or self.path is not None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def is_allowed(self, user_id: int) -> bool:
+        self.lookups += 1
+        if user_id in self._ids:
+            return True
+        self.denials += 1
+        return False
+
+    def should_notify(self, user_id: int) -> bool:
+        """True, если этому незнакомцу давно не отвечали отказом."""
+        if self._denied.get(user_id):
+            return False
+        self._denied.set(user_id, True)
+        return True
+
+    def reload(self) -> bool:
+        """Перечитывает файл, если он изменился. True — список обновлён."""
+        if self.path is None:
+            return False
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self._mtime:
+                return False
+            with open(self.path, encoding="utf-8") as file:
+                file_ids = parse_ids(file)
+        except OSError as e:
+            logger.error(f"Failed to read allowed users file: {e}")
+            return False
+
+        self._ids = self.static_ids | file_ids
+        self._mtime = mtime
+        self.reloads += 1
+        logger.info(f"Whitelist loaded: {len(self._ids)} users")
+        return True
+
+    def start(self) -> None:
+        self.reload()
+        if self.path and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            self.reload()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "users": len(self._ids),
+            "lookups": self.lookups,
+            "denials": self.denials,
+            "reloads": self.reloads,
+        }
+
+
+# Singleton instance
+access_control = AccessControlStore(
+    static_ids=config.ALLOWED_USER_IDS,
+    path=config.ALLOWED_USERS_FILE,
+    reload_interval=config.ACCESS_RELOAD_INTERVAL,
+    notify_interval=config.ACCESS_DENIED_NOTIFY_INTERVAL,
+)
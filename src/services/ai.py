@@ -1,8 +1,17 @@
+import asyncio
+import json
 import logging
+import re
 import time
-from typing import List, Dict, Any
+from typing import AsyncIterator, List, Dict, Any, Tuple
 
-from openai import AsyncOpenAI, APIError, RateLimitError, APIConnectionError
+from openai import (
+    AsyncOpenAI,
+    APIError,
+    APIStatusError,
+    RateLimitError,
+    APIConnectionError,
+)
 from tenacity import (
     retry,
     stop_after_attempt,
@@ -12,9 +21,65 @@ from tenacity import (
 )
 
 from src.config import config
+from src.services.cache import TTLCache
+from src.services.circuit_breaker import CircuitBreakerRegistry, CircuitOpenError
+from src.services.gif_classifier import CATEGORIES, GifClassifier
+from src.services.rate_limiter import AdmissionController, Priority, estimate_tokens
+from src.services.single_flight import SingleFlight, request_key
 
 # Configure logger
 logger = logging.getLogger(__name__)
+# Per-call token usage: a separate logger so LOG_SAMPLING never drops it
+usage_logger = logging.getLogger(f"{__name__}.usage")
+
+_WORD_RE = re.compile(r"[a-zа-яё]+")
+_NEGATIONS = frozenset({"не", "ни", "нет", "no", "not"})
+
+FALLBACK_RESPONSE = "Мозг коуча сейчас перезагружается, попробуй позже."
+
+# Errors worth another attempt (shared by _make_request and streaming)
+RETRYABLE_ERRORS = (APIError, APIConnectionError, RateLimitError, ConnectionError)
+MAX_ATTEMPTS = 3
+
+
+def _text_features(text: str | None) -> Tuple[str, ...]:
+    """
+    Нормализует текст в последовательность псевдо-основ (первые 5 букв).
+    Регистр, пунктуация и окончания слов на ключ не влияют; порядок слов
+    и короткие слова ("но", "ок") сохраняются, а отрицание склеивается
+    со следующим словом, чтобы "не доволен" не совпадал с "доволен".
+    """
+    if not text:
+        return ()
+    words = _WORD_RE.findall(text.lower().replace("ё", "е"))
+    features = []
+    negation = ""
+    for word in words:
+        if word in _NEGATIONS:
+            negation += word + "_"
+            continue
+        features.append(negation + word[:5])
+        negation = ""
+    if negation:
+        features.append(negation.rstrip("_"))
+    return tuple(features)
+
+
+def gif_cache_key(context: str, mood: str | None) -> Tuple[Tuple[str, ...], ...]:
+    """Ключ кеша категории GIF по нормализованным (context, mood)."""
+    return (_text_features(context), _text_features(mood))
+
+
+def _is_outage(error: Exception) -> bool:
+    """
+    Errors that mean the API itself is unhealthy (trip the circuit breaker):
+    5xx responses, timeouts and connection failures. 429 is not an outage.
+    """
+    if isinstance(error, APIStatusError):
+        return error.status_code >= 500
+    return isinstance(
+        error, (APIConnectionError, ConnectionError, asyncio.TimeoutError)
+    )
 
 
 class AIService:
@@ -23,49 +88,281 @@ class AIService:
             api_key=config.OPENAI_KEY.get_secret_value(), timeout=60.0
         )
         self.model = config.OPENAI_MODEL
+        # AICODE-NOTE: choose_gif_category возвращает одно из 5 слов, а context —
+        # фиксированные строки из хендлеров, поэтому ответы хорошо кешируются
+        self.gif_cache: TTLCache[str] = TTLCache(
+            maxsize=config.GIF_CACHE_SIZE, ttl=config.GIF_CACHE_TTL
+        )
+        self.gif_classifier = GifClassifier.load_or_seed(
+            config.GIF_CLASSIFIER_MODEL_PATH
+        )
+        self.gif_stats = {"local": 0, "llm": 0, "fallback": 0}
+        self.admission = AdmissionController(
+            rpm=config.OPENAI_RPM_LIMIT,
+            tpm=config.OPENAI_TPM_LIMIT,
+            max_concurrent=config.OPENAI_MAX_CONCURRENT,
+        )
+        self.breakers = CircuitBreakerRegistry(
+            window=config.AI_BREAKER_WINDOW,
+            min_calls=config.AI_BREAKER_MIN_CALLS,
+            failure_rate=config.AI_BREAKER_FAILURE_RATE,
+            open_seconds=config.AI_BREAKER_OPEN_SECONDS,
+        )
+
+        self.single_flight: SingleFlight[str] = SingleFlight()
+        self.usage_stats = {
+            "requests": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cached_tokens": 0,
+        }
+
+    def is_available(self) -> bool:
+        """False while the circuit breaker for the current model is open."""
+        return self.breakers.get(self.model).is_available()
+
+    def _record_usage(self, usage: Any) -> int | None:
+        """Logs and accumulates token usage of one call; returns total tokens."""
+        if usage is None:
+            return None
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", None) or 0) if details else 0
+        self.usage_stats["requests"] += 1
+        self.usage_stats["prompt_tokens"] += usage.prompt_tokens
+        self.usage_stats["completion_tokens"] += usage.completion_tokens
+        self.usage_stats["cached_tokens"] += cached
+        usage_logger.info(
+            "AI usage: prompt=%d (cached=%d), completion=%d",
+            usage.prompt_tokens,
+            cached,
+            usage.completion_tokens,
+        )
+        return usage.total_tokens
+
+    def _record_error(self, breaker, error: Exception) -> None:
+        if _is_outage(error):
+            breaker.record_failure()
+        elif isinstance(error, RateLimitError):
+            # 429 is our own quota being exhausted; the admission controller
+            # paces retries, so it says nothing about API health either way
+            breaker.record_ignored()
+        else:
+            # The API answered (e.g. 400) — it is up, the request was bad
+            breaker.record_success()
 
     @retry(
-        stop=stop_after_attempt(3),
+        stop=stop_after_attempt(MAX_ATTEMPTS),
         wait=wait_exponential(multiplier=1, min=4, max=10),
-        retry=retry_if_exception_type(
-            (APIError, APIConnectionError, RateLimitError, ConnectionError)
-        ),
+        retry=retry_if_exception_type(RETRYABLE_ERRORS),
         before_sleep=before_sleep_log(logger, logging.WARNING),
     )
-    async def _make_request(self, messages: List[Dict[str, Any]], **kwargs) -> str:
-        """Internal method to make the actual API call with retries."""
+    async def _make_request(
+        self,
+        messages: List[Dict[str, Any]],
+        priority: Priority = Priority.NORMAL,
+        admission_timeout: float | None = None,
+        **kwargs,
+    ) -> str:
+        """
+        Internal method to make the actual API call with retries.
+
+        AICODE-NOTE: Every attempt (including tenacity retries) waits for
+        admission, so retries are paced by the RPM/TPM buckets instead of
+        hitting the API all at once. AdmissionTimeout is not retried.
+        CircuitOpenError is raised before queueing and is not retried either,
+        so an open breaker also cuts short the remaining attempts.
+        """
+        breaker = self.breakers.get(self.model)
+        breaker.before_call()
+
+        estimated = estimate_tokens(messages, kwargs.get("max_tokens"))
+        try:
+            await self.admission.acquire(priority, estimated, admission_timeout)
+        except BaseException:
+            breaker.record_ignored()
+            raise
+
         start_time = time.time()
+        used_tokens = None
         try:
             # AICODE-NOTE: Using chat completions for both text and vision
             response = await self.client.chat.completions.create(
                 model=self.model, messages=messages, **kwargs
             )
+            breaker.record_success()
             latency = time.time() - start_time
-            logger.info(f"AI Request successful. Latency: {latency:.2f}s")
+            logger.info("AI Request successful. Latency: %.2fs", latency)
+            used_tokens = self._record_usage(response.usage)
             return response.choices[0].message.content or ""
         except Exception as e:
-            logger.error(f"AI Request failed: {e}")
+            logger.error("AI Request failed: %s", e)
+            self._record_error(breaker, e)
             raise e
+        finally:
+            self.admission.release(estimated, used_tokens)
 
-    async def get_chat_response(self, messages: List[Dict[str, Any]], **kwargs) -> str:
+    async def _request(
+        self,
+        messages: List[Dict[str, Any]],
+        coalesce: bool | None = None,
+        **kwargs,
+    ) -> str:
         """
-        Public method to get chat response with fallback.
+        _make_request behind a single-flight layer.
+
+        AICODE-NOTE: Concurrent identical requests share one upstream call.
+        Only deterministic calls (temperature=0) are coalesced by default —
+        sampled answers are expected to differ, so callers opt in explicitly.
         """
-        # Log shortened prompt for debugging
-        if messages:
+        if coalesce is None:
+            coalesce = kwargs.get("temperature") == 0
+        if not coalesce:
+            return await self._make_request(messages, **kwargs)
+
+        # priority/admission_timeout don't change the upstream request
+        params = {
+            k: v
+            for k, v in kwargs.items()
+            if k not in ("priority", "admission_timeout")
+        }
+        key = request_key(self.model, messages, params)
+        return await self.single_flight.do(
+            key, lambda: self._make_request(messages, **kwargs)
+        )
+
+    def _log_request(self, messages: List[Dict[str, Any]]) -> None:
+        """Log shortened prompt for debugging."""
+        # Build the preview only if INFO is enabled for this logger
+        if messages and logger.isEnabledFor(logging.INFO):
             last_msg = messages[-1].get("content", "")
             if isinstance(last_msg, str):
                 preview = last_msg[:100] + "..." if len(last_msg) > 100 else last_msg
-                logger.info(f"Sending AI request: {preview}")
+                logger.info("Sending AI request: %s", preview)
             elif isinstance(last_msg, list):
                 logger.info("Sending AI request with multimodal content")
 
+    async def get_chat_response(
+        self,
+        messages: List[Dict[str, Any]],
+        priority: Priority = Priority.NORMAL,
+        **kwargs,
+    ) -> str:
+        """
+        Public method to get chat response with fallback.
+        """
+        self._log_request(messages)
+
         try:
-            return await self._make_request(messages, **kwargs)
+            return await self._request(messages, priority=priority, **kwargs)
+        except CircuitOpenError:
+            logger.warning("AI circuit is open. Returning fallback.")
+            return FALLBACK_RESPONSE
         except Exception:
             logger.error("All AI retries failed. Returning fallback.")
             # Fallback as per plan
-            return "Мозг коуча сейчас перезагружается, попробуй позже."
+            return FALLBACK_RESPONSE
+
+    async def stream_chat_response(
+        self,
+        messages: List[Dict[str, Any]],
+        priority: Priority = Priority.NORMAL,
+        **kwargs,
+    ) -> AsyncIterator[str]:
+        """
+        Streaming variant of get_chat_response: yields text chunks as they arrive.
+
+        AICODE-NOTE: Until the first token arrives the request is retried with
+        the same attempts, backoff and error types as _make_request. After
+        that a stream can't be replayed (the user has seen part of it), so a
+        mid-stream failure just ends the stream with what was received.
+        If every attempt fails, or the circuit breaker is open, the fallback
+        text is yielded instead.
+        """
+        self._log_request(messages)
+
+        received = False
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            chunks = self._stream_once(messages, priority, **kwargs)
+            try:
+                async for delta in chunks:
+                    received = True
+                    yield delta
+                return
+            except CircuitOpenError:
+                logger.warning("AI circuit is open. Returning fallback.")
+                yield FALLBACK_RESPONSE
+                return
+            except Exception as e:
+                retryable = isinstance(e, RETRYABLE_ERRORS)
+                if received or not retryable or attempt == MAX_ATTEMPTS:
+                    logger.error("AI stream failed: %s", e)
+                    if not received:
+                        yield FALLBACK_RESPONSE
+                    return
+                # Same schedule as wait_exponential(min=4, max=10) in _make_request
+                delay = min(10, max(4, 2 ** (attempt - 1)))
+                logger.warning(
+                    "AI stream failed before first token (%s), retrying in %ss",
+                    e,
+                    delay,
+                )
+            finally:
+                await chunks.aclose()
+            await asyncio.sleep(delay)
+
+    async def _stream_once(
+        self,
+        messages: List[Dict[str, Any]],
+        priority: Priority,
+        **kwargs,
+    ) -> AsyncIterator[str]:
+        """One streaming attempt: breaker, admission and usage accounting."""
+        breaker = self.breakers.get(self.model)
+        breaker.before_call()
+
+        estimated = estimate_tokens(messages, kwargs.get("max_tokens"))
+        recorded = admitted = received = False
+        used_tokens = None
+        try:
+            await self.admission.acquire(priority, estimated)
+            admitted = True
+            start_time = time.time()
+            stream = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                # The last chunk carries usage with empty choices
+                stream_options={"include_usage": True},
+                **kwargs,
+            )
+            async for chunk in stream:
+                if chunk.usage:
+                    used_tokens = self._record_usage(chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                if not received:
+                    received = True
+                    logger.info(
+                        "AI stream first token after %.2fs", time.time() - start_time
+                    )
+                yield delta
+            breaker.record_success()
+            recorded = True
+            logger.info("AI stream finished. Latency: %.2fs", time.time() - start_time)
+        except Exception as e:
+            if admitted:
+                self._record_error(breaker, e)
+                recorded = True
+            raise
+        finally:
+            if admitted:
+                self.admission.release(estimated, used_tokens)
+            if not recorded:
+                # Stream closed early or never admitted — free a half-open probe
+                breaker.record_ignored()
 
     async def choose_gif_category(self, context: str, mood: str = None) -> str:
         """
@@ -78,9 +375,23 @@ class AIService:
         - you_got_this: мотивация (нейтральное/позитивное завершение)
         - rest: отдых (пользователь устал, не хочет ничего делать)
 
+        AICODE-NOTE: Сначала работает локальный классификатор (микросекунды).
+        LLM вызывается только если его уверенность ниже порога.
+
         Returns:
             Название категории GIF
         """
+        local_category, confidence = self.gif_classifier.predict(context, mood)
+        if confidence >= config.GIF_CLASSIFIER_THRESHOLD:
+            self.gif_stats["local"] += 1
+            return local_category
+
+        cache_key = gif_cache_key(context, mood)
+        cached = self.gif_cache.get(cache_key)
+        if cached:
+            logger.debug("GIF category cache hit: %s", cached)
+            return cached
+
         prompt = f"""На основе контекста и настроения выбери ОДНУ категорию GIF для отправки пользователю.
 
 Контекст: {context}
@@ -96,43 +407,66 @@ class AIService:
 Ответь ТОЛЬКО одним словом — названием категории."""
 
         try:
-            response = await self._make_request(
-                [{"role": "user", "content": prompt}], temperature=0.3, max_tokens=20
+            # Одинаковый context/mood у разных пользователей — один запрос
+            response = await self._request(
+                [{"role": "user", "content": prompt}],
+                coalesce=True,
+                priority=Priority.LOW,
+                admission_timeout=config.GIF_ADMISSION_TIMEOUT,
+                temperature=0.3,
+                max_tokens=20,
             )
 
             category = response.strip().lower()
-            valid_categories = {
-                "support",
-                "breathe",
-                "celebration_small",
-                "you_got_this",
-                "rest",
-            }
-
-            if category not in valid_categories:
+
+            if category not in CATEGORIES:
                 logger.warning(
-                    f"LLM returned invalid category: {category}, "
-                    f"falling back to you_got_this"
+                    "LLM returned invalid category: %s, falling back to you_got_this",
+                    category,
                 )
                 return "you_got_this"
 
+            self.gif_stats["llm"] += 1
+            self.gif_cache.set(cache_key, category)
+            await self._log_gif_training_sample(context, mood, category)
             return category
 
         except Exception as e:
-            logger.warning(f"Failed to get GIF category from LLM: {e}")
-            # Простой fallback на основе ключевых слов
-            context_lower = context.lower()
-            if any(w in context_lower for w in ["кризис", "плохо", "тяжело", "грустн"]):
-                return "support"
-            elif any(w in context_lower for w in ["дыхан", "выдох", "вдох"]):
-                return "breathe"
-            elif any(
-                w in context_lower for w in ["сделал", "чек-ин", "отчет", "готово"]
-            ):
-                return "celebration_small"
-            elif any(w in context_lower for w in ["отдых", "устал", "не сейчас"]):
-                return "rest"
-            return "you_got_this"
+            logger.warning("Failed to get GIF category from LLM: %s", e)
+            # Fallback — лучший ответ локального классификатора
+            self.gif_stats["fallback"] += 1
+            return local_category
+
+    async def _log_gif_training_sample(
+        self, context: str, mood: str | None, category: str
+    ) -> None:
+        """Пишет решение LLM в JSONL для офлайн-обучения GifClassifier."""
+        if not config.GIF_TRAINING_LOG:
+            return
+        line = json.dumps(
+            {"context": context, "mood": mood, "category": category},
+            ensure_ascii=False,
+        )
+
+        def append() -> None:
+            with open(config.GIF_TRAINING_LOG, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+        try:
+            await asyncio.to_thread(append)
+        except OSError as e:
+            logger.warning("Failed to write GIF training sample: %s", e)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Метрики сервиса для логов и health-эндпоинтов."""
+        return {
+            "gif_cache": self.gif_cache.stats(),
+            "gif_category": self.gif_stats,
+            "admission": self.admission.stats(),
+            "circuit_breakers": self.breakers.stats(),
+            "single_flight": self.single_flight.stats(),
+            "usage": self.usage_stats,
+        }
 
 
 # Singleton instance
@@ -0,0 +1,109 @@
+"""
+Content-addressed хранилище изображений на локальном диске.
+
+AICODE-NOTE: Файл адресуется SHA-256 своего содержимого и лежит в
+<root>/<ab>/<cd>/<sha256>. В строках Goal/CheckIn хранится только хеш,
+поэтому списки целей и чек-инов больше не тянут мегабайты base64 из SQLite.
+Одинаковые фото сохраняются один раз, учёт ссылок ведётся в ImageBlob.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from pathlib import Path
+
+from tortoise.expressions import F
+
+from src.config import config
+from src.database.models import ImageBlob
+
+logger = logging.getLogger(__name__)
+
+
+def compute_hash(data: bytes) -> str:
+    """Возвращает SHA-256 содержимого в hex."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class BlobStore:
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def path_for(self, sha256: str) -> Path:
+        """Путь к файлу блоба (с шардированием по первым байтам хеша)."""
+        return self.root / sha256[:2] / sha256[2:4] / sha256
+
+    def write_file(self, sha256: str, data: bytes) -> None:
+        """Синхронно записывает файл блоба (без учёта ссылок)."""
+        path = self.path_for(sha256)
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Атомарная запись: сначала во временный файл, затем rename
+        tmp_path = path.with_name(f"{sha256}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    async def put(self, data: bytes) -> str:
+        """
+        Сохраняет изображение и увеличивает счётчик ссылок.
+
+        Returns:
+            SHA-256 содержимого — его и нужно хранить в модели
+        """
+        sha256 = compute_hash(data)
+        await asyncio.to_thread(self.write_file, sha256, data)
+        await self._add_ref(sha256, len(data))
+        # Параллельный release мог удалить файл между записью и учётом ссылки —
+        # запись идемпотентна, поэтому просто восстанавливаем его
+        await asyncio.to_thread(self.write_file, sha256, data)
+        return sha256
+
+    async def _add_ref(self, sha256: str, size: int) -> None:
+        # AICODE-NOTE: Счётчик меняется только атомарными UPDATE ... F() ± 1.
+        # Запись создаётся сразу с ref_count=1: строка с нулём могла бы быть
+        # удалена параллельным release до инкремента.
+        while not await self.add_ref(sha256):
+            _, created = await ImageBlob.get_or_create(
+                sha256=sha256, defaults={"size": size, "ref_count": 1}
+            )
+            if created:
+                break
+        logger.debug(f"Stored blob {sha256} ({size} bytes)")
+
+    async def add_ref(self, sha256: str) -> bool:
+        """
+        Увеличивает счётчик ссылок уже сохранённого блоба.
+        False — такого блоба нет (уже удалён), нужно сохранить заново.
+        """
+        updated = await ImageBlob.filter(sha256=sha256).update(
+            ref_count=F("ref_count") + 1
+        )
+        return bool(updated)
+
+    async def get(self, sha256: str) -> bytes | None:
+        """Читает изображение по хешу. None если файла нет."""
+        path = self.path_for(sha256)
+        try:
+            return await asyncio.to_thread(path.read_bytes)
+        except FileNotFoundError:
+            logger.warning(f"Blob {sha256} not found at {path}")
+            return None
+
+    async def release(self, sha256: str) -> None:
+        """
+        Уменьшает счётчик ссылок. Когда ссылок не остаётся,
+        удаляет файл и запись ImageBlob.
+        """
+        await ImageBlob.filter(sha256=sha256).update(ref_count=F("ref_count") - 1)
+        # Условный DELETE: если между декрементом и удалением блоб снова
+        # получил ссылку, строка (и файл) останутся
+        deleted = await ImageBlob.filter(sha256=sha256, ref_count__lte=0).delete()
+        if deleted:
+            await asyncio.to_thread(self.path_for(sha256).unlink, missing_ok=True)
+            logger.debug(f"Deleted blob {sha256}")
+
+
+# Singleton instance
+blob_store = BlobStore(config.BLOB_STORE_PATH)
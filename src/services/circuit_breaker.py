@@ -0,0 +1,141 @@
+"""
+Circuit breaker для запросов к OpenAI.
+
+AICODE-NOTE: Когда OpenAI деградирует, каждый запрос тратит до трёх попыток
+с паузами 4–10 секунд, а пользователь всё это время смотрит на заглушку.
+Breaker считает долю сбоев в скользящем окне и при превышении порога
+размыкается (open): запросы сразу получают CircuitOpenError, вызывающий код
+отдаёт fallback. Через open_seconds breaker пропускает пробный запрос
+(half-open): успех замыкает его, сбой — снова размыкает.
+"""
+
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Breaker разомкнут — запрос не отправлялся."""
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        window: float = 60.0,
+        min_calls: int = 5,
+        failure_rate: float = 0.5,
+        open_seconds: float = 30.0,
+        half_open_calls: int = 1,
+    ):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        # (время, успех) за последние window секунд
+        self._calls: Deque[Tuple[float, bool]] = deque()
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        if (
+            self._state == OPEN
+            and time.monotonic() - self._opened_at >= self.open_seconds
+        ):
+            self._state = HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def is_available(self) -> bool:
+        """Пропустит ли breaker запрос прямо сейчас."""
+        state = self.state
+        if state == OPEN:
+            return False
+        return state == CLOSED or self._probes < self.half_open_calls
+
+    def before_call(self) -> None:
+        """Бросает CircuitOpenError, если запрос отправлять нельзя."""
+        if not self.is_available():
+            self.rejected += 1
+            raise CircuitOpenError(f"Circuit for {self.name} is {self._state}")
+        if self._state == HALF_OPEN:
+            self._probes += 1
+
+    def record_success(self) -> None:
+        if self._state == HALF_OPEN:
+            self._close()
+            return
+        self._record(True)
+
+    def record_failure(self) -> None:
+        if self._state == HALF_OPEN:
+            self._open()
+            return
+        self._record(False)
+        failures = sum(1 for _, ok in self._calls if not ok)
+        if (
+            len(self._calls) >= self.min_calls
+            and failures / len(self._calls) >= self.failure_rate
+        ):
+            self._open()
+
+    def record_ignored(self) -> None:
+        """Запрос завершился без ответа API (например, не дождался очереди)."""
+        if self._state == HALF_OPEN and self._probes:
+            self._probes -= 1
+
+    def _record(self, ok: bool) -> None:
+        now = time.monotonic()
+        self._calls.append((now, ok))
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+    def _open(self) -> None:
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._calls.clear()
+        self.opened += 1
+
+    def _close(self) -> None:
+        self._state = CLOSED
+        self._calls.clear()
+        self._probes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        failures = sum(1 for _, ok in self._calls if not ok)
+        return {
+            "state": self.state,
+            "calls_in_window": len(self._calls),
+            "failures_in_window": failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class CircuitBreakerRegistry:
+    """Отдельный breaker на каждую модель: сбой одной не глушит другие."""
+
+    def __init__(self, **breaker_kwargs: Any):
+        self._breaker_kwargs = breaker_kwargs
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, **self._breaker_kwargs)
+            self._breakers[name] = breaker
+        return breaker
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: b.stats() for name, b in self._breakers.items()}
@@ -0,0 +1,208 @@
+"""
+Локальный классификатор категории GIF (без сетевых вызовов).
+
+AICODE-NOTE: Модель — взвешенные признаки по псевдо-основам русских слов
+(первые 5 букв) и их биграммам. По умолчанию используются веса из ключевых
+слов, которые раньше жили в fallback AIService.choose_gif_category.
+Модель можно переобучить офлайн на логах решений LLM (context, mood, category):
+
+    python -m src.services.gif_classifier data/gif_training.jsonl \\
+        src/data/gif_classifier.json
+
+Обучение — мультиномиальный наивный Байес, предсказание — softmax по суммам
+весов, поэтому confidence сопоставим для seed- и обученной модели.
+
+AICODE-NOTE: Если есть mood (ответ пользователя), категория и confidence
+считаются только по нему. Context — фиксированная строка хендлера
+("выполнил чек-ин..."), она одинакова и для удачного, и для провального
+дня и иначе перевешивала бы настроение. По context решаем, только когда
+mood нет. Отрицание склеивается со следующим словом: "не получилось"
+даёт признак "не_получ", а не "получ".
+"""
+
+import json
+import logging
+import math
+import re
+import sys
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = ("support", "breathe", "celebration_small", "you_got_this", "rest")
+DEFAULT_CATEGORY = "you_got_this"
+
+_WORD_RE = re.compile(r"[a-zа-яё]+")
+_NEGATIONS = frozenset({"не", "ни", "нет", "no", "not"})
+
+# Seed-веса: одно совпадение даёт confidence ~0.65
+_SEED_WEIGHT = 2.0
+SEED_KEYWORDS: Dict[str, List[str]] = {
+    "support": [
+        "кризи",
+        "плохо",
+        "тяжел",
+        "грустн",
+        "тревог",
+        "страш",
+        "одино",
+        "не_получ",
+        "не_смог",
+        "не_сдела",
+        "не_выпол",
+    ],
+    "breathe": ["дыхан", "выдох", "вдох", "медит", "спокой", "рассл"],
+    # Без "получ": это и "получилось", и "ничего не получилось"
+    "celebration_small": ["сделал", "чек", "отчет", "готов", "выпол"],
+    "you_got_this": ["мотив", "шаг", "цель", "завер"],
+    "rest": ["отдых", "устал", "не_сейча", "выгор"],
+}
+
+
+def extract_features(text: Optional[str]) -> List[str]:
+    """Униграммы и биграммы псевдо-основ; отрицание — часть следующего слова."""
+    if not text:
+        return []
+    stems: List[str] = []
+    negation = ""
+    for word in _WORD_RE.findall(text.lower().replace("ё", "е")):
+        if word in _NEGATIONS:
+            negation = "не_"
+            continue
+        stems.append(negation + word[:5])
+        negation = ""
+    features = [s for s in stems if len(s) > 2]
+    features += [f"{a}_{b}" for a, b in zip(stems, stems[1:])]
+    return features
+
+
+def _sample_features(context: Optional[str], mood: Optional[str]) -> List[str]:
+    """Признаки для решения: mood, если он есть, иначе context."""
+    if mood and mood.strip():
+        return extract_features(mood)
+    return extract_features(context)
+
+
+class GifClassifier:
+    def __init__(
+        self,
+        weights: Dict[str, Dict[str, float]],
+        bias: Optional[Dict[str, float]] = None,
+        unknown: Optional[Dict[str, float]] = None,
+    ):
+        self.weights = weights
+        self.bias = bias or {c: 0.0 for c in CATEGORIES}
+        # Вес признака, который есть в словаре, но не встречался у категории
+        self.unknown = unknown or {c: 0.0 for c in CATEGORIES}
+        self.vocabulary = {f for per_cat in weights.values() for f in per_cat}
+
+    @classmethod
+    def seed(cls) -> "GifClassifier":
+        weights = {
+            category: {_normalize_seed(k): _SEED_WEIGHT for k in keywords}
+            for category, keywords in SEED_KEYWORDS.items()
+        }
+        return cls(weights)
+
+    @classmethod
+    def train(
+        cls, samples: Iterable[Tuple[str, Optional[str], str]], alpha: float = 1.0
+    ) -> "GifClassifier":
+        """Обучает наивный Байес на парах (context, mood, category)."""
+        doc_counts: Counter = Counter()
+        feature_counts: Dict[str, Counter] = defaultdict(Counter)
+        for context, mood, category in samples:
+            if category not in CATEGORIES:
+                continue
+            doc_counts[category] += 1
+            feature_counts[category].update(_sample_features(context, mood))
+
+        total_docs = sum(doc_counts.values())
+        if not total_docs:
+            raise ValueError("No valid training samples")
+
+        vocabulary = {f for counts in feature_counts.values() for f in counts}
+        size = len(vocabulary)
+        prior_denominator = total_docs + alpha * len(CATEGORIES)
+        weights, bias, unknown = {}, {}, {}
+        for category in CATEGORIES:
+            counts = feature_counts[category]
+            denominator = sum(counts.values()) + alpha * size
+            bias[category] = math.log(
+                (doc_counts[category] + alpha) / prior_denominator
+            )
+            unknown[category] = math.log(alpha / denominator)
+            weights[category] = {
+                f: math.log((n + alpha) / denominator) for f, n in counts.items()
+            }
+        return cls(weights, bias, unknown)
+
+    def predict(self, context: str, mood: Optional[str] = None) -> Tuple[str, float]:
+        """
+        Returns:
+            (категория, confidence в диапазоне 0..1); 0.0 — модель не знает
+            ни одного признака (в том числе если mood есть, но незнакомый)
+        """
+        features = [
+            f for f in _sample_features(context, mood) if f in self.vocabulary
+        ]
+        if not features:
+            return DEFAULT_CATEGORY, 0.0
+
+        scores = {}
+        for category in CATEGORIES:
+            per_cat = self.weights.get(category, {})
+            scores[category] = self.bias.get(category, 0.0) + sum(
+                per_cat.get(f, self.unknown.get(category, 0.0)) for f in features
+            )
+
+        best = max(scores, key=scores.get)
+        top = scores[best]
+        total = sum(math.exp(score - top) for score in scores.values())
+        return best, 1.0 / total
+
+    def to_dict(self) -> dict:
+        return {"weights": self.weights, "bias": self.bias, "unknown": self.unknown}
+
+    def save(self, path: str) -> None:
+        Path(path).write_text(
+            json.dumps(self.to_dict(), ensure_ascii=False), encoding="utf-8"
+        )
+
+    @classmethod
+    def load_or_seed(cls, path: Optional[str]) -> "GifClassifier":
+        """Загружает обученную модель, при её отсутствии — seed-веса."""
+        if path and Path(path).exists():
+            try:
+                data = json.loads(Path(path).read_text(encoding="utf-8"))
+                logger.info(f"Loaded GIF classifier from {path}")
+                return cls(data["weights"], data.get("bias"), data.get("unknown"))
+            except (json.JSONDecodeError, KeyError) as e:
+                logger.error(f"Invalid GIF classifier model {path}: {e}")
+        return cls.seed()
+
+
+def _normalize_seed(keyword: str) -> str:
+    return "_".join(part[:5] for part in keyword.split("_"))
+
+
+def load_training_log(path: str) -> List[Tuple[str, Optional[str], str]]:
+    """Читает JSONL-лог решений LLM: {"context", "mood", "category"}."""
+    samples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                samples.append((row["context"], row.get("mood"), row["category"]))
+    return samples
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python -m src.services.gif_classifier <log.jsonl> <model.json>")
+        sys.exit(1)
+    samples = load_training_log(sys.argv[1])
+    GifClassifier.train(samples).save(sys.argv[2])
+    print(f"Trained on {len(samples)} samples -> {sys.argv[2]}")
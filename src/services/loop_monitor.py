@@ -0,0 +1,71 @@
+"""
+Мониторинг задержки event loop.
+
+AICODE-NOTE: Задача спит interval секунд и меряет, насколько позже она
+проснулась. Если кто-то держит loop (синхронный CPU-код, блокирующий I/O),
+задержка растёт у всех пользователей сразу — это и показывает lag.
+Раз в REPORT_INTERVAL в лог пишется сводка, при lag выше порога — warning.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+REPORT_INTERVAL = 60.0
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = 0.5, warn_threshold: float = 0.1):
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.slow_ticks = 0
+        self._window_max = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        next_report = time.monotonic() + REPORT_INTERVAL
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - started - self.interval, 0.0)
+
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self._window_max = max(self._window_max, lag)
+            if lag > self.warn_threshold:
+                self.slow_ticks += 1
+                logger.warning(f"Event loop lag {lag * 1000:.0f}ms")
+
+            if now >= next_report:
+                logger.info(
+                    f"Event loop lag: max {self._window_max * 1000:.0f}ms "
+                    f"over last {REPORT_INTERVAL:.0f}s"
+                )
+                self._window_max = 0.0
+                next_report = now + REPORT_INTERVAL
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "last_lag_ms": round(self.last_lag * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "slow_ticks": self.slow_ticks,
+        }
+
+
+# Singleton instance
+loop_monitor = LoopLagMonitor()
@@ -0,0 +1,78 @@
+"""
+Загрузка фото из Telegram с дедупликацией по file_unique_id.
+
+AICODE-NOTE: В BlobStore сохраняется оригинал (самый большой PhotoSize),
+а для vision он уменьшается в памяти (VISION_MAX_EDGE) и никуда
+не пишется. file_unique_id одинаков для одного и того же файла у всех
+пользователей и при повторной отправке, поэтому по нему кешируется хеш
+оригинала: повторное фото читается с диска, без скачивания. Кеш хранит
+только хеши, сами байты — в BlobStore.
+
+AICODE-NOTE: load() сразу учитывает ссылку на блоб. Если строка Goal/CheckIn
+с этим хешем так и не создана (ошибка, ранний выход из хендлера), ссылку
+нужно вернуть через discard(), иначе блоб никогда не удалится.
+"""
+
+import logging
+from typing import List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.types import PhotoSize
+
+from src.config import config
+from src.services.blob_store import blob_store
+from src.services.cache import TTLCache
+from src.services.vision import download_telegram_photo, image_pipeline
+
+logger = logging.getLogger(__name__)
+
+
+class PhotoService:
+    def __init__(self):
+        self.hash_cache: TTLCache[str] = TTLCache(
+            maxsize=config.PHOTO_CACHE_SIZE, ttl=config.PHOTO_CACHE_TTL
+        )
+
+    async def load(self, bot: Bot, photos: List[PhotoSize]) -> Tuple[bytes, str]:
+        """
+        Возвращает подготовленное для vision изображение и хеш оригинала
+        в BlobStore. Ссылка на блоб уже учтена — хеш можно сразу сохранять
+        в модель.
+        """
+        photo = max(photos, key=lambda p: p.width * p.height)
+
+        original = None
+        image_hash = self.hash_cache.get(photo.file_unique_id)
+        if image_hash:
+            original = await blob_store.get(image_hash)
+            if original is not None and await blob_store.add_ref(image_hash):
+                logger.debug(f"Photo {photo.file_unique_id} reused from blob store")
+            else:
+                # Блоб удалён — скачиваем фото заново
+                original = None
+                self.hash_cache.pop(photo.file_unique_id)
+
+        if original is None:
+            original = await download_telegram_photo(bot, photo.file_id)
+            image_hash = await blob_store.put(original)
+            self.hash_cache.set(photo.file_unique_id, image_hash)
+
+        try:
+            image_bytes = await image_pipeline.preprocess(original)
+        except BaseException:
+            await blob_store.release(image_hash)
+            raise
+        return image_bytes, image_hash
+
+    async def discard(self, image_hash: Optional[str]) -> None:
+        """Возвращает ссылку, взятую load(), если строка с хешем не создана."""
+        if not image_hash:
+            return
+        try:
+            await blob_store.release(image_hash)
+        except Exception as e:
+            logger.error(f"Failed to release blob {image_hash}: {e}")
+
+
+# Singleton instance
+photo_service = PhotoService()
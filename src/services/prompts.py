@@ -0,0 +1,221 @@
+"""
+Реестр промптов коуча: статические префиксы, подсчёт токенов и бюджет.
+
+AICODE-NOTE: Статическая часть (system-промпт со всеми инструкциями) всегда
+идёт первой и не меняется между вызовами — провайдер может переиспользовать
+закешированный префикс. Всё, что зависит от пользователя, — в последнем
+user-сообщении. Токены статической части считаются один раз при регистрации.
+Если пользовательский текст не влезает в бюджет, поля из `truncatable`
+обрезаются по очереди (суммаризация стоила бы ещё одного запроса к LLM).
+
+Точный подсчёт — через tiktoken, если он установлен; иначе грубая оценка
+по числу символов (с запасом для кириллицы).
+"""
+
+import logging
+import math
+from dataclasses import dataclass, field
+from functools import lru_cache
+from string import Formatter
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.config import config
+from src.services.vision import IMAGE_TOKENS, prepare_vision_payload
+
+try:
+    import tiktoken
+except ImportError:  # опциональная зависимость
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Оценка без tiktoken: русский текст ~3 символа на токен
+_CHARS_PER_TOKEN = 3
+TRUNCATION_MARK = "…"
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> Optional[Any]:
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(config.OPENAI_MODEL)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # Нет доступа к файлам словаря — работаем на оценке
+        logger.warning(f"tiktoken unavailable, using estimate: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return math.ceil(len(text) / _CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Обрезает текст до max_tokens (с меткой обрезки)."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _encoding()
+    if encoding is not None:
+        truncated = encoding.decode(encoding.encode(text)[:max_tokens])
+    else:
+        truncated = text[: max_tokens * _CHARS_PER_TOKEN]
+    return truncated.rstrip() + TRUNCATION_MARK
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    name: str
+    system: str
+    # str.format-шаблон пользовательского сообщения
+    user: str
+    max_input_tokens: int
+    max_output_tokens: int
+    # Поля, которые можно обрезать, — в порядке обрезки
+    truncatable: Tuple[str, ...] = ()
+    # Токены статических частей, считаются один раз
+    static_tokens: int = field(init=False)
+
+    def __post_init__(self) -> None:
+        fields = {name: "" for _, name, _, _ in Formatter().parse(self.user) if name}
+        object.__setattr__(
+            self,
+            "static_tokens",
+            count_tokens(self.system) + count_tokens(self.user.format(**fields)),
+        )
+
+    def render(
+        self, images: Optional[List[str]] = None, **fields: Any
+    ) -> List[Dict[str, Any]]:
+        """
+        Собирает messages: сначала статический system, затем user-часть,
+        уложенная в max_input_tokens.
+        """
+        values = {name: str(value) for name, value in fields.items()}
+        budget = self.max_input_tokens - self.static_tokens
+        budget -= len(images or []) * IMAGE_TOKENS[config.VISION_DETAIL]
+
+        sizes = {name: count_tokens(value) for name, value in values.items()}
+        overflow = sum(sizes.values()) - budget
+        for name in self.truncatable:
+            if overflow <= 0:
+                break
+            keep = max(sizes[name] - overflow, 0)
+            values[name] = truncate_to_tokens(values[name], keep)
+            overflow -= sizes[name] - keep
+        if sum(sizes.values()) > budget:
+            logger.info(
+                f"Prompt {self.name}: user content truncated to {budget} tokens"
+            )
+
+        user_text = self.user.format(**values)
+        messages: List[Dict[str, Any]] = [{"role": "system", "content": self.system}]
+        if images:
+            messages.extend(prepare_vision_payload(user_text, images))
+        else:
+            messages.append({"role": "user", "content": user_text})
+        return messages
+
+
+class PromptRegistry:
+    def __init__(self):
+        self._templates: Dict[str, PromptTemplate] = {}
+
+    def register(self, template: PromptTemplate) -> PromptTemplate:
+        self._templates[template.name] = template
+        logger.debug(
+            f"Registered prompt {template.name}: {template.static_tokens} static tokens"
+        )
+        return template
+
+    def get(self, name: str) -> PromptTemplate:
+        return self._templates[name]
+
+
+prompts = PromptRegistry()
+
+
+# ============== Промпты ==============
+
+CHECKIN_PROMPT = prompts.register(
+    PromptTemplate(
+        name="checkin",
+        system=(
+            "Ты - опытный коуч по достижению целей. Твоя задача - поддержать "
+            "пользователя и дать конструктивный совет на основе его отчета.\n\n"
+            "Проанализируй прогресс. Дай краткую обратную связь: "
+            "1. Похвали за сделанное.\n"
+            "2. Дай 1 конкретный совет, что можно улучшить или сделать "
+            "следующим шагом.\n"
+            "Ответ должен быть мотивирующим, но кратким (до 100 слов)."
+        ),
+        user=(
+            "Цель: {title}\n"
+            "Описание цели: {description}\n\n"
+            "Отчет пользователя: {report}"
+        ),
+        max_input_tokens=2000,
+        max_output_tokens=500,
+        truncatable=("description", "report", "title"),
+    )
+)
+
+GOAL_PLAN_PROMPT = prompts.register(
+    PromptTemplate(
+        name="goal_plan",
+        system=(
+            "Ты — опытный и эмпатичный коуч. Твоя задача — вдохновить пользователя "
+            "и дать 3 первых шага к цели."
+        ),
+        user=(
+            "Моя цель: {title}\n"
+            "Описание: {description}\n\n"
+            "Дай мне мотивирующий пинок и 3 простых шага для начала."
+        ),
+        max_input_tokens=2000,
+        max_output_tokens=800,
+        truncatable=("description", "title"),
+    )
+)
+
+REFLECT_PROMPT = prompts.register(
+    PromptTemplate(
+        name="reflect",
+        system="""\
+Ты — эмпатичный коуч и психолог. Пользователь только что прошёл \
+сессию саморефлексии и ответил на вопросы о своём состоянии.
+
+Твоя задача:
+1. Проанализировать ответы и понять эмоциональное состояние человека
+2. Выявить ключевой паттерн или блок, который мешает двигаться
+3. Дать 2-3 персонализированные рекомендации
+
+Правила:
+- Используй тёплый, поддерживающий тон
+- Не читай мораль, не давай банальных советов
+- Опирайся на конкретные слова пользователя
+- Рекомендации должны быть практичными и выполнимыми сегодня
+- Длина ответа: 3-5 абзацев максимум
+- Используй эмодзи умеренно
+
+Формат ответа:
+[Краткий анализ состояния — 1-2 предложения]
+
+[Что я заметил/паттерн — 1-2 предложения]
+
+Мои рекомендации:
+1. [Конкретное действие]
+2. [Конкретное действие]
+3. [Опционально: третья рекомендация]
+
+[Тёплое завершение — 1 предложение]""",
+        user="Ответы пользователя на вопросы рефлексии:\n\n{answers}",
+        max_input_tokens=2500,
+        max_output_tokens=800,
+        truncatable=("answers",),
+    )
+)
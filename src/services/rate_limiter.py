@@ -0,0 +1,211 @@
+"""
+Допуск запросов к OpenAI: token bucket по RPM/TPM и очередь с приоритетами.
+
+AICODE-NOTE: Без ограничения всплеск чек-инов превращается в пачку
+RateLimitError, после чего tenacity откатывает все запросы одновременно
+и они снова бьют в лимит. AdmissionController выпускает запросы не быстрее
+лимита аккаунта (RPM и TPM) и не больше max_concurrent одновременно,
+а ожидающих обслуживает строго по приоритету: кризис и рефлексия раньше
+чек-инов, выбор GIF — в последнюю очередь. Один event loop, без потоков.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from enum import IntEnum
+from typing import Any, Dict, List, Optional
+
+from src.config import config
+from src.services.prompts import count_tokens
+from src.services.vision import IMAGE_TOKENS
+
+
+class Priority(IntEnum):
+    """Меньше значение — раньше обслуживается."""
+
+    HIGH = 0  # кризис, рефлексия
+    NORMAL = 1  # чек-ины, постановка целей
+    LOW = 2  # выбор GIF — есть локальный fallback
+
+
+# Ожидаемый ответ, если max_tokens не задан
+_DEFAULT_COMPLETION_TOKENS = 500
+
+
+def estimate_tokens(
+    messages: List[Dict[str, Any]], max_tokens: Optional[int] = None
+) -> int:
+    """
+    Оценка токенов запроса для TPM-лимита (prompt + ожидаемый ответ).
+    Текст считается тем же count_tokens, что и бюджет промптов.
+    """
+    tokens = 0
+    images = 0
+    for message in messages:
+        content = message.get("content", "")
+        if isinstance(content, str):
+            tokens += count_tokens(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    tokens += count_tokens(part.get("text", ""))
+                elif part.get("type") == "image_url":
+                    images += 1
+    completion = max_tokens if max_tokens is not None else _DEFAULT_COMPLETION_TOKENS
+    image_tokens = images * IMAGE_TOKENS[config.VISION_DETAIL]
+    return tokens + image_tokens + completion
+
+
+class AdmissionTimeout(Exception):
+    """Запрос не дождался своей очереди."""
+
+
+class TokenBucket:
+    """Ведро на `capacity` единиц, пополняется равномерно за минуту."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self._updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    def time_until(self, amount: float) -> float:
+        """Сколько секунд ждать, пока в ведре наберётся amount."""
+        self._refill()
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        """Списывает amount; может уйти в минус при корректировке по факту."""
+        self._refill()
+        self.tokens -= amount
+
+
+class AdmissionController:
+    def __init__(self, rpm: int, tpm: int, max_concurrent: int):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+
+        # Элементы кучи: [priority, seq, tokens, future]
+        self._queue: List[list] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._pump_task: Optional[asyncio.Task] = None
+
+        self._stats = {
+            p: {"admitted": 0, "timeouts": 0, "wait_total": 0.0, "wait_max": 0.0}
+            for p in Priority
+        }
+
+    async def acquire(
+        self, priority: Priority, tokens: int, timeout: Optional[float] = None
+    ) -> None:
+        """Ждёт разрешения на запрос. После ответа обязательно вызвать release()."""
+        # Запрос больше ведра иначе не прошёл бы никогда
+        tokens = min(tokens, int(self.tokens.capacity))
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, [priority, next(self._seq), tokens, future])
+        self._wake()
+
+        enqueued_at = time.monotonic()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._stats[priority]["timeouts"] += 1
+            self._wake()
+            raise AdmissionTimeout(
+                f"{priority.name} request waited more than {timeout}s"
+            )
+        except asyncio.CancelledError:
+            # Слот мог быть выдан в момент отмены — вернём его
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                self._wake()
+            raise
+
+        waited = time.monotonic() - enqueued_at
+        stats = self._stats[priority]
+        stats["admitted"] += 1
+        stats["wait_total"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+
+    def release(self, estimated: int = 0, actual: Optional[int] = None) -> None:
+        """
+        Освобождает слот. Если известен фактический расход токенов (usage),
+        разница с оценкой списывается/возвращается в TPM-ведро.
+        """
+        self.in_flight -= 1
+        if actual is not None:
+            self.tokens.consume(actual - min(estimated, int(self.tokens.capacity)))
+        self._wake()
+
+    def _wake(self) -> None:
+        self._wakeup.set()
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+
+    async def _pump(self) -> None:
+        """Выпускает ожидающих по приоритету, пока позволяют лимиты."""
+        while self._queue:
+            priority, _, tokens, future = self._queue[0]
+            if future.done():
+                # Отменён или истёк timeout
+                heapq.heappop(self._queue)
+                continue
+
+            if self.in_flight >= self.max_concurrent:
+                delay = None
+            else:
+                delay = max(
+                    self.requests.time_until(1), self.tokens.time_until(tokens)
+                )
+            if delay != 0.0:
+                # Ждём освобождения слота, пополнения ведра или нового запроса
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._queue)
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+            self.in_flight += 1
+            future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        depth = {p.name.lower(): 0 for p in Priority}
+        for priority, _, _, future in self._queue:
+            if not future.done():
+                depth[Priority(priority).name.lower()] += 1
+
+        waits = {}
+        for priority, stats in self._stats.items():
+            admitted = stats["admitted"]
+            wait_avg = stats["wait_total"] / admitted if admitted else 0.0
+            waits[priority.name.lower()] = {
+                "admitted": admitted,
+                "timeouts": stats["timeouts"],
+                "wait_avg": round(wait_avg, 3),
+                "wait_max": round(stats["wait_max"], 3),
+            }
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": depth,
+            "rpm_available": int(self.requests.tokens),
+            "tpm_available": int(self.tokens.tokens),
+            "priorities": waits,
+        }
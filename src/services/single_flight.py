@@ -0,0 +1,63 @@
+"""
+Single-flight: одинаковые одновременные запросы делят один вызов.
+
+AICODE-NOTE: Промпты choose_gif_category и другие детерминированные вызовы
+часто совпадают у разных пользователей в один момент. Первый вызов с данным
+ключом запускает задачу, остальные ждут её результат (или исключение).
+Задача защищена shield — отмена одного из ждущих не отменяет запрос
+для остальных. После завершения ключ удаляется: это не кеш.
+"""
+
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Generic, TypeVar
+
+T = TypeVar("T")
+
+
+def request_key(model: str, messages: Any, params: Dict[str, Any]) -> str:
+    """sha256 канонического JSON (model, messages, params)."""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SingleFlight(Generic[T]):
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[T]]) -> T:
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(self._forget(key))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str) -> Callable[[asyncio.Task], None]:
+        def callback(task: asyncio.Task) -> None:
+            self._inflight.pop(key, None)
+            # Все ждущие могли быть отменены — забираем исключение,
+            # чтобы не было "exception was never retrieved"
+            if not task.cancelled():
+                task.exception()
+
+        return callback
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._inflight),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+        }
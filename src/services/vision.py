@@ -1,31 +1,207 @@
-import base64
+import asyncio
+import binascii
 import io
-from typing import List, Dict, Any
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, TypeVar, Union
 
 from aiogram import Bot
+from aiogram.types import File
+from PIL import Image, ImageOps
 
+from src.config import config
 
-async def download_telegram_photo(bot: Bot, file_id: str) -> io.BytesIO:
+# Approximate vision token cost per image for each detail level
+IMAGE_TOKENS = {"low": 85, "high": 765, "auto": 765}
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Multiple of 3, so only the last slice gets base64 padding
+BASE64_CHUNK_SIZE = 3 * 16 * 1024
+DATA_URL_PREFIX = b"data:image/jpeg;base64,"
+
+T = TypeVar("T")
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class ImagePipeline:
     """
-    Downloads a photo from Telegram and returns it as BytesIO.
+    Runs CPU-bound image work (decode/resize/encode, base64) off the event loop.
+
+    AICODE-NOTE: A dedicated bounded pool keeps image jobs from starving the
+    default executor (used by the FSM storage and shard queues). At most
+    max_pending jobs are queued or running; further callers wait on the
+    semaphore, which pushes back on photo-heavy bursts instead of growing
+    an unbounded executor queue.
     """
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="image"
+        )
+        self._slots = asyncio.Semaphore(max_pending)
+        self.max_pending = max_pending
+        self.pending = 0
+        self.completed = 0
+        self.max_queue_wait = 0.0
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        enqueued_at = time.monotonic()
+        async with self._slots:
+            self.pending += 1
+            try:
+                loop = asyncio.get_running_loop()
+                future = loop.run_in_executor(self._executor, func, *args)
+                self.max_queue_wait = max(
+                    self.max_queue_wait, time.monotonic() - enqueued_at
+                )
+                return await future
+            finally:
+                self.pending -= 1
+                self.completed += 1
+
+    async def preprocess(self, data: Buffer) -> bytes:
+        return await self.run(
+            preprocess_image,
+            data,
+            config.VISION_MAX_EDGE,
+            config.VISION_JPEG_QUALITY,
+        )
+
+    async def encode_data_url(self, data: Buffer) -> str:
+        return await self.run(encode_image_data_url, data)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "max_queue_wait": round(self.max_queue_wait, 3),
+        }
+
+
+class FileTooLargeError(ValueError):
+    """Telegram file exceeds the configured size cap."""
+
+
+async def _get_file(bot: Bot, file_id: str, max_bytes: int) -> File:
     file = await bot.get_file(file_id)
+    if file.file_size and file.file_size > max_bytes:
+        raise FileTooLargeError(f"File is {file.file_size} bytes, limit {max_bytes}")
+    return file
+
+
+async def _file_chunks(bot: Bot, file: File, max_bytes: int) -> AsyncIterator[bytes]:
+    # file_size from Telegram is optional — enforce the cap on actual bytes too
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    received = 0
+    async for chunk in bot.session.stream_content(
+        url, chunk_size=DOWNLOAD_CHUNK_SIZE, raise_for_status=True
+    ):
+        received += len(chunk)
+        if received > max_bytes:
+            raise FileTooLargeError(f"File exceeds limit of {max_bytes} bytes")
+        yield chunk
+
+
+async def download_telegram_photo(
+    bot: Bot, file_id: str, max_bytes: int | None = None
+) -> memoryview:
+    """
+    Downloads a photo from Telegram into a single preallocated buffer.
+
+    AICODE-NOTE: The buffer is sized from file_size and chunks are copied
+    into it in place; callers get a memoryview, so nothing downstream
+    (preprocess_image, encode_image_to_base64) copies the whole file again.
+    """
+    max_bytes = config.PHOTO_MAX_BYTES if max_bytes is None else max_bytes
+    file = await _get_file(bot, file_id, max_bytes)
+
+    buffer = bytearray(file.file_size or DOWNLOAD_CHUNK_SIZE)
+    length = 0
+    async for chunk in _file_chunks(bot, file, max_bytes):
+        end = length + len(chunk)
+        if end > len(buffer):
+            # file_size was missing or inaccurate — grow geometrically
+            buffer.extend(bytes(max(end, 2 * len(buffer)) - len(buffer)))
+        buffer[length:end] = chunk
+        length = end
+    return memoryview(buffer)[:length]
+
+
+class _MemoryReader(io.RawIOBase):
+    """Read-only file object over a memoryview (io.BytesIO would copy it)."""
+
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}
+        self._pos = max(base[whence] + offset, 0)
+        return self._pos
 
-    # Create a BytesIO object to hold the file
-    output = io.BytesIO()
-    # Download the file to the BytesIO object
-    await bot.download(file, output)
-    # Reset cursor to start of file
-    output.seek(0)
-    return output
+    def readinto(self, b) -> int:
+        end = self._pos + len(b)
+        chunk = self._view[self._pos:end]
+        size = len(chunk)
+        b[:size] = chunk
+        self._pos += size
+        return size
 
 
-def encode_image_to_base64(image_data: io.BytesIO) -> str:
-    """Converts BytesIO image data to base64 string."""
-    return base64.b64encode(image_data.read()).decode("utf-8")
+def preprocess_image(data: Buffer, max_edge: int, quality: int) -> bytes:
+    """
+    Downscales the image to max_edge on the long side and re-encodes it
+    as a baseline JPEG without EXIF. CPU-bound — run it via ImagePipeline.
+
+    AICODE-NOTE: exif_transpose applies the orientation tag before it is
+    dropped, otherwise phone photos would end up rotated.
+    """
+    with Image.open(_MemoryReader(memoryview(data))) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
 
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+        return output.getvalue()
+
+
+def encode_image_data_url(image_data: Buffer) -> str:
+    """
+    Converts JPEG bytes to a "data:image/jpeg;base64,..." URL.
 
-def prepare_vision_payload(text: str, base64_images: List[str]) -> List[Dict[str, Any]]:
+    Encodes slice by slice into one preallocated buffer that already holds
+    the URL prefix, so the only full-size copy is the final bytes -> str
+    conversion (a str can't share memory with a buffer).
+    Blocks for large images — await image_pipeline.encode_data_url from handlers.
+    """
+    view = memoryview(image_data)
+    prefix = len(DATA_URL_PREFIX)
+    output = bytearray(prefix + 4 * ((len(view) + 2) // 3))
+    output[:prefix] = DATA_URL_PREFIX
+    for start in range(0, len(view), BASE64_CHUNK_SIZE):
+        end = start + BASE64_CHUNK_SIZE
+        encoded = binascii.b2a_base64(view[start:end], newline=False)
+        offset = prefix + start // 3 * 4
+        output[offset:offset + len(encoded)] = encoded
+    return output.decode("ascii")
+
+
+def prepare_vision_payload(text: str, image_urls: List[str]) -> List[Dict[str, Any]]:
     """
     Prepares the message payload for GPT Vision.
     Structure:
@@ -36,7 +212,10 @@ def prepare_vision_payload(text: str, base64_images: List[str]) -> List[Dict[str
                 {"type": "text", "text": "description"},
                 {
                     "type": "image_url",
-                    "image_url": {"url": "data:image/jpeg;base64,..."}
+                    "image_url": {
+                        "url": "data:image/jpeg;base64,...",
+                        "detail": "low"
+                    }
                 }
             ]
         }
@@ -44,12 +223,23 @@ def prepare_vision_payload(text: str, base64_images: List[str]) -> List[Dict[str
     """
     content: List[Dict[str, Any]] = [{"type": "text", "text": text}]
 
-    for img_b64 in base64_images:
+    for url in image_urls:
         content.append(
             {
                 "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"},
+                "image_url": {
+                    # Already a data URL (encode_image_data_url) — no extra copy
+                    "url": url,
+                    # Explicit detail keeps vision token cost predictable
+                    "detail": config.VISION_DETAIL,
+                },
             }
         )
 
     return [{"role": "user", "content": content}]
+
+
+# Singleton instance
+image_pipeline = ImagePipeline(
+    max_workers=config.IMAGE_WORKERS, max_pending=config.IMAGE_MAX_PENDING
+)
@@ -0,0 +1,6 @@
+import os
+
+# Settings() читается при импорте src.config — тестам токены не нужны
+os.environ.setdefault("BOT_TOKEN", "123:test")
+os.environ.setdefault("OPENAI_KEY", "test")
+os.environ.setdefault("LOG_FILE", "")
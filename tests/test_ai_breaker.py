@@ -0,0 +1,40 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+from openai import BadRequestError, InternalServerError, RateLimitError
+
+from src.services.ai import ai_service
+
+
+def status_error(cls, status_code):
+    response = SimpleNamespace(request=None, status_code=status_code, headers={})
+    return cls("error", response=response, body=None)
+
+
+def record(error):
+    breaker = Mock()
+    ai_service._record_error(breaker, error)
+    return breaker
+
+
+def test_server_error_is_a_failure():
+    breaker = record(status_error(InternalServerError, 503))
+    breaker.record_failure.assert_called_once()
+
+
+def test_timeout_and_connection_errors_are_failures():
+    for error in (asyncio.TimeoutError(), ConnectionError()):
+        record(error).record_failure.assert_called_once()
+
+
+def test_rate_limit_is_ignored():
+    breaker = record(status_error(RateLimitError, 429))
+    breaker.record_ignored.assert_called_once()
+    breaker.record_failure.assert_not_called()
+    breaker.record_success.assert_not_called()
+
+
+def test_bad_request_means_api_is_up():
+    breaker = record(status_error(BadRequestError, 400))
+    breaker.record_success.assert_called_once()
@@ -0,0 +1,68 @@
+import asyncio
+
+from tortoise import Tortoise
+
+from src.database.models import ImageBlob
+from src.services.blob_store import BlobStore
+
+
+def run_with_db(coro_factory):
+    async def main():
+        await Tortoise.init(
+            db_url="sqlite://:memory:", modules={"models": ["src.database.models"]}
+        )
+        await Tortoise.generate_schemas()
+        try:
+            await coro_factory()
+        finally:
+            await Tortoise.close_connections()
+
+    asyncio.run(main())
+
+
+def test_put_and_release_track_references(tmp_path):
+    store = BlobStore(str(tmp_path))
+
+    async def scenario():
+        sha256 = await store.put(b"photo")
+        assert await store.put(b"photo") == sha256
+        assert (await ImageBlob.get(sha256=sha256)).ref_count == 2
+
+        await store.release(sha256)
+        assert store.path_for(sha256).exists()
+        assert (await ImageBlob.get(sha256=sha256)).ref_count == 1
+
+        await store.release(sha256)
+        assert not store.path_for(sha256).exists()
+        assert await ImageBlob.get_or_none(sha256=sha256) is None
+
+    run_with_db(scenario)
+
+
+def test_concurrent_puts_count_every_reference(tmp_path):
+    store = BlobStore(str(tmp_path))
+
+    async def scenario():
+        hashes = await asyncio.gather(*(store.put(b"photo") for _ in range(10)))
+        sha256 = hashes[0]
+        assert (await ImageBlob.get(sha256=sha256)).ref_count == 10
+
+        await asyncio.gather(*(store.release(sha256) for _ in range(10)))
+        assert await ImageBlob.get_or_none(sha256=sha256) is None
+        assert not store.path_for(sha256).exists()
+
+    run_with_db(scenario)
+
+
+def test_release_keeps_file_while_referenced(tmp_path):
+    store = BlobStore(str(tmp_path))
+
+    async def scenario():
+        sha256 = await store.put(b"photo")
+        # Ссылка появилась между декрементом и удалением — файл должен остаться
+        await ImageBlob.filter(sha256=sha256).update(ref_count=2)
+        await store.release(sha256)
+        assert store.path_for(sha256).exists()
+        assert (await ImageBlob.get(sha256=sha256)).ref_count == 1
+
+    run_with_db(scenario)
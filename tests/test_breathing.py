@@ -0,0 +1,45 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+from src.bot.breathing import INTROS, breathing_scheduler, start_breathing
+
+
+def make_callback(user_id=1, chat_id=10):
+    message = SimpleNamespace(chat=SimpleNamespace(id=chat_id), edit_text=AsyncMock())
+    return SimpleNamespace(
+        from_user=SimpleNamespace(id=user_id), message=message, answer=AsyncMock()
+    )
+
+
+def test_start_breathing_shows_intro_and_schedules():
+    callback = make_callback()
+
+    async def scenario():
+        await start_breathing(callback, "box", finisher="reflect")
+
+    asyncio.run(scenario())
+    try:
+        callback.message.edit_text.assert_awaited_once_with(INTROS["box"])
+        callback.answer.assert_awaited_once()
+        (session,) = breathing_scheduler.snapshot()
+        assert session["technique"] == "box"
+        assert session["finisher"] == "reflect"
+        assert session["chat_id"] == 10
+    finally:
+        breathing_scheduler.cancel(1)
+
+
+def test_restart_replaces_unfinished_session():
+    callback = make_callback()
+
+    async def scenario():
+        await start_breathing(callback, "478", finisher="crisis")
+        await start_breathing(callback, "478", finisher="crisis", intro="again")
+
+    asyncio.run(scenario())
+    try:
+        callback.message.edit_text.assert_awaited_with("again")
+        assert len(breathing_scheduler.snapshot()) == 1
+    finally:
+        breathing_scheduler.cancel(1)
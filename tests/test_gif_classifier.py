@@ -0,0 +1,48 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+from src.services.gif_classifier import GifClassifier, extract_features
+
+# Фиксированный context из src/bot/handlers/checkin.py
+CHECKIN_CONTEXT = "Пользователь выполнил чек-ин, отчитался о прогрессе по цели"
+SAD_MOOD = "мне очень плохо сегодня, ничего не получилось"
+
+
+def test_negation_is_fused_with_next_word():
+    features = extract_features("ничего не получилось")
+    assert "не_получ" in features
+    assert "получ" not in features
+
+
+def test_sad_checkin_is_not_celebrated():
+    category, _ = GifClassifier.seed().predict(CHECKIN_CONTEXT, SAD_MOOD)
+    assert category != "celebration_small"
+    assert category == "support"
+
+
+def test_context_alone_decides_without_mood():
+    category, _ = GifClassifier.seed().predict(CHECKIN_CONTEXT)
+    assert category == "celebration_small"
+
+
+def test_unknown_mood_has_no_confidence():
+    _, confidence = GifClassifier.seed().predict(
+        CHECKIN_CONTEXT, "сегодня ходил в магазин"
+    )
+    assert confidence == 0.0
+
+
+def test_low_confidence_falls_through_to_llm():
+    from src.services.ai import ai_service
+
+    request = AsyncMock(return_value="support")
+    with (
+        patch.object(ai_service, "_request", request),
+        patch("src.services.ai.config.GIF_TRAINING_LOG", None),
+    ):
+        category = asyncio.run(
+            ai_service.choose_gif_category(CHECKIN_CONTEXT, "сегодня ходил в магазин")
+        )
+
+    assert category == "support"
+    request.assert_awaited_once()
@@ -0,0 +1,64 @@
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+from src.bot.storage import SQLiteStorage
+
+KEY = StorageKey(bot_id=1, chat_id=2, user_id=3)
+
+
+def test_failed_flush_is_retried(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / "fsm.sqlite3"), flush_interval=0.01)
+        write = storage._write
+        calls = 0
+
+        async def flaky_write(batch):
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                raise OSError("disk I/O error")
+            await write(batch)
+
+        storage._write = flaky_write
+        await storage.set_state(KEY, "CheckInStates:waiting_for_report")
+        await asyncio.wait_for(storage._flusher, timeout=5)
+
+        # Свежее хранилище читает состояние из базы, а не из буфера
+        reopened = SQLiteStorage(str(tmp_path / "fsm.sqlite3"))
+        try:
+            state = await reopened.get_state(KEY)
+        finally:
+            await reopened.close()
+            await storage.close()
+        assert calls == 2
+        assert state == "CheckInStates:waiting_for_report"
+
+    asyncio.run(scenario())
+
+
+def test_changes_made_during_flush_are_flushed(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / "fsm.sqlite3"), flush_interval=0.01)
+        write = storage._write
+
+        async def slow_write(batch):
+            await asyncio.sleep(0.05)
+            await write(batch)
+
+        storage._write = slow_write
+        await storage.set_data(KEY, {"step": 1})
+        await asyncio.sleep(0.03)
+        # Первая пачка ещё пишется — новое изменение ждёт следующего круга
+        await storage.set_data(KEY, {"step": 2})
+        await asyncio.wait_for(storage._flusher, timeout=5)
+
+        reopened = SQLiteStorage(str(tmp_path / "fsm.sqlite3"))
+        try:
+            data = await reopened.get_data(KEY)
+        finally:
+            await reopened.close()
+            await storage.close()
+        assert data == {"step": 2}
+
+    asyncio.run(scenario())
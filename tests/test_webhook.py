@@ -0,0 +1,30 @@
+import asyncio
+
+from src.bot.webhook import ConcurrencyLimitMiddleware
+
+
+def test_limits_concurrent_updates_and_counts_waiting():
+    async def scenario():
+        limiter = ConcurrencyLimitMiddleware(max_concurrent_updates=2)
+        release = asyncio.Event()
+        running = 0
+        peak = 0
+
+        async def handler(event, data):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await release.wait()
+            running -= 1
+
+        tasks = [asyncio.create_task(limiter(handler, object(), {})) for _ in range(5)]
+        await asyncio.sleep(0.01)
+        assert limiter.in_flight == 5
+        assert running == 2
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert peak == 2
+        assert limiter.in_flight == 0
+
+    asyncio.run(scenario())